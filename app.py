@@ -15,9 +15,16 @@ logging.getLogger('werkzeug').setLevel(logging.ERROR)
 warnings.filterwarnings("ignore", category=UserWarning)
 os.environ['FLASK_ENV'] = 'development'
 
-from utils.face_detection import detect_face
-from utils.skin_analysis import analyze_skin, calculate_skin_health_score
-from utils.skin_classifier import classify_skin_type
+from utils.face_detection import detect_face, detect_faces_batch, warm_up_detectors, get_detector_stats
+from utils.face_tracking import end_tracking, get_face_tracker
+from utils.image_ingest import analysis_scale, ingest_image, normalize_face_crop, persist_upload_async
+from utils.image_quality import check_frame_quality, check_face_quality
+from utils.skin_analysis import (
+    SCORED_DETECTORS, analyze_skin, calculate_skin_health_score, get_skin_detector_stats, select_detectors
+)
+from utils.buffer_arena import arena_pool
+from utils.stream_analysis import end_stream_session, get_stream_session
+from utils.skin_classifier import classify_skin_type, skin_model_registry
 from utils.recommendations import get_skincare_recommendations
 from chatbot.bot_engine import get_chatbot_response
 from utils.pdf_generator import generate_pdf_report
@@ -26,17 +33,105 @@ app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here-change-in-production')
+app.config['PERSIST_UPLOADS'] = os.environ.get('PERSIST_UPLOADS', '1') != '0'  # Keep a copy of the original upload
+# Uploads are decoded to at most this many pixels on the longest side, face crops are analyzed at most at this size
+app.config['INGEST_MAX_SIDE'] = int(os.environ.get('INGEST_MAX_SIDE', 1600))
+app.config['ANALYSIS_MAX_SIDE'] = int(os.environ.get('ANALYSIS_MAX_SIDE', 1024))
+# Optional reduced working resolution for skin analysis (0 = analyze the crop as is); calibrate with utils/resolution_calibration.py
+app.config['ANALYSIS_WORKING_SIDE'] = int(os.environ.get('ANALYSIS_WORKING_SIDE', 0))
+# Run the detectors of one analysis in parallel on the shared pool (ANALYSIS_PARALLEL=1); off until
+# the latency gain has been measured on a multi-core deployment
+app.config['ANALYSIS_PARALLEL'] = os.environ.get('ANALYSIS_PARALLEL', '0') != '0'
+# Reject blurry, dark, overexposed or far-away captures before the analysis pipeline runs
+app.config['QUALITY_GATE'] = os.environ.get('QUALITY_GATE', '1') != '0'
+# Optional face detection latency budget in ms; without one the detector tier follows server load
+app.config['FACE_DETECTION_BUDGET_MS'] = float(os.environ['FACE_DETECTION_BUDGET_MS']) if os.environ.get('FACE_DETECTION_BUDGET_MS') else None
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs('static/reports', exist_ok=True)
 os.makedirs('models', exist_ok=True)
 
+# Load face detectors once per process instead of on every request
+warm_up_detectors()
+
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def read_upload(file):
+    """
+    Decode an uploaded file in memory at bounded resolution
+    Returns: (image: numpy array or None, data: bytes, image_info: dict)
+    """
+    data = file.read()
+    image, image_info = ingest_image(data, app.config['INGEST_MAX_SIDE'])
+    return image, data, image_info
+
+def save_upload(data, original_filename, prefix=''):
+    """
+    Persist the original upload in the background if enabled
+    Returns: filepath the upload is written to, or None
+    """
+    if not app.config['PERSIST_UPLOADS']:
+        return None
+    
+    filename = f"{prefix}{uuid.uuid4()}.{original_filename.rsplit('.', 1)[1].lower()}"
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    persist_upload_async(data, filepath)
+    return filepath
+
+def save_report(filepath, skin_type, health_score, analysis, recommendations):
+    """
+    Store an analysis report for the current user
+    Returns: report_id
+    """
+    user_id = session.get('user_id')
+    session_id = request.cookies.get('session_id', str(uuid.uuid4()))
+    report_id = str(uuid.uuid4())
+    
+    conn = sqlite3.connect('skincare.db')
+    c = conn.cursor()
+    
+    # Check if user_id column exists
+    c.execute('PRAGMA table_info(reports)')
+    columns = [row[1] for row in c.fetchall()]
+    has_user_id = 'user_id' in columns
+    
+    if has_user_id:
+        c.execute('''
+            INSERT INTO reports (id, user_id, session_id, image_path, skin_type, health_score, analysis_data, recommendations)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            report_id,
+            user_id,
+            session_id,
+            filepath,
+            skin_type,
+            health_score,
+            json.dumps(analysis),
+            json.dumps(recommendations)
+        ))
+    else:
+        # Fallback for old schema
+        c.execute('''
+            INSERT INTO reports (id, session_id, image_path, skin_type, health_score, analysis_data, recommendations)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            report_id,
+            session_id,
+            filepath,
+            skin_type,
+            health_score,
+            json.dumps(analysis),
+            json.dumps(recommendations)
+        ))
+    
+    conn.commit()
+    conn.close()
+    return report_id
+
 def migrate_database():
     """Migrate database to add user_id columns if they don't exist"""
     conn = sqlite3.connect('skincare.db')
@@ -291,19 +386,64 @@ def analyze():
             return jsonify({'error': 'No file selected'}), 400
         
         if file and allowed_file(file.filename):
-            # Generate unique filename
-            filename = f"{uuid.uuid4()}.{file.filename.rsplit('.', 1)[1].lower()}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            # Callers that only need some metrics can name the detectors to run
+            detectors = request.form.get('detectors')
+            detectors = [name.strip() for name in detectors.split(',')] if detectors else None
+            # Opt-in grids of local severity, e.g. to show where the redness is
+            heatmaps = request.form.get('heatmaps', '').lower() in ('1', 'true', 'on')
+            try:
+                select_detectors(detectors)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            # Without every scored metric the health score and skin type would be made up from
+            # defaults, so a subset is returned unscored and not stored in the user's history
+            partial = detectors is not None and not set(SCORED_DETECTORS) <= set(detectors)
             
-            # Detect face
-            face_detected, face_image = detect_face(filepath)
+            # Decode once in memory
+            image, data, image_info = read_upload(file)
+            if image is None:
+                return jsonify({'error': 'Could not read image file'}), 400
+            
+            # Reject blurry or badly exposed frames before running the full pipeline
+            if app.config['QUALITY_GATE']:
+                quality = check_frame_quality(image)
+                if not quality['passed']:
+                    return jsonify({'error': quality['message'], 'quality': quality}), 422
+            
+            # Detect face; frames of one webcam session are tracked from the last face position
+            stream_id = request.form.get('stream_id')
+            if stream_id:
+                tracker = get_face_tracker(f"{session.get('user_id')}:{stream_id}")
+                face_detected, face_image = tracker.detect(image)
+            else:
+                latency_budget_ms = request.form.get('latency_budget_ms', app.config['FACE_DETECTION_BUDGET_MS'], type=float)
+                face_detected, face_image = detect_face(image, latency_budget_ms=latency_budget_ms)
             
             if not face_detected:
                 return jsonify({'error': 'No face detected in the image'}), 400
             
-            # Analyze skin
-            analysis = analyze_skin(filepath, face_image)
+            if app.config['QUALITY_GATE']:
+                quality = check_face_quality(face_image, image.shape)
+                if not quality['passed']:
+                    return jsonify({'error': quality['message'], 'quality': quality}), 422
+            
+            # The original is written to disk in the background
+            filepath = None if partial else save_upload(data, file.filename)
+            
+            # Analyze skin on a size-bounded crop and keep the original dimensions in the report
+            face_image = normalize_face_crop(face_image, image_info, app.config['ANALYSIS_MAX_SIDE'])
+            analysis_stats = {}
+            analysis = analyze_skin(
+                filepath, face_image, app.config['ANALYSIS_WORKING_SIDE'], analysis_stats,
+                detectors=detectors, parallel=app.config['ANALYSIS_PARALLEL'], heatmaps=heatmaps,
+                scale=analysis_scale(image_info)
+            )
+            analysis['image_info'] = image_info
+            # Diagnostics stay out of the stored report; aggregates are served by /detector_stats
+            app.logger.debug('Analysis stats: %s', analysis_stats)
+            
+            if partial:
+                return jsonify({'success': True, 'partial': True, 'analysis': analysis})
             
             # Calculate skin health score
             health_score = calculate_skin_health_score(analysis)
@@ -315,49 +455,7 @@ def analyze():
             recommendations = get_skincare_recommendations(skin_type, analysis)
             
             # Save to database
-            user_id = session.get('user_id')
-            session_id = request.cookies.get('session_id', str(uuid.uuid4()))
-            report_id = str(uuid.uuid4())
-            
-            conn = sqlite3.connect('skincare.db')
-            c = conn.cursor()
-            
-            # Check if user_id column exists
-            c.execute('PRAGMA table_info(reports)')
-            columns = [row[1] for row in c.fetchall()]
-            has_user_id = 'user_id' in columns
-            
-            if has_user_id:
-                c.execute('''
-                    INSERT INTO reports (id, user_id, session_id, image_path, skin_type, health_score, analysis_data, recommendations)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    report_id,
-                    user_id,
-                    session_id,
-                    filepath,
-                    skin_type,
-                    health_score,
-                    json.dumps(analysis),
-                    json.dumps(recommendations)
-                ))
-            else:
-                # Fallback for old schema
-                c.execute('''
-                    INSERT INTO reports (id, session_id, image_path, skin_type, health_score, analysis_data, recommendations)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    report_id,
-                    session_id,
-                    filepath,
-                    skin_type,
-                    health_score,
-                    json.dumps(analysis),
-                    json.dumps(recommendations)
-                ))
-            
-            conn.commit()
-            conn.close()
+            report_id = save_report(filepath, skin_type, health_score, analysis, recommendations)
             
             return jsonify({
                 'success': True,
@@ -376,6 +474,94 @@ def analyze():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/analyze/stream', methods=['POST'])
+@login_required
+def analyze_stream_frame():
+    """Analyze one frame of a continuous webcam session; nothing is stored until the session ends"""
+    try:
+        stream_id = request.form.get('stream_id')
+        if not stream_id:
+            return jsonify({'error': 'No stream_id provided'}), 400
+        if 'image' not in request.files or not allowed_file(request.files['image'].filename):
+            return jsonify({'error': 'No image file provided'}), 400
+        
+        file = request.files['image']
+        image, data, image_info = read_upload(file)
+        if image is None:
+            return jsonify({'error': 'Could not read image file'}), 400
+        
+        # Bad frames are skipped, the session keeps its current estimate
+        if app.config['QUALITY_GATE']:
+            quality = check_frame_quality(image)
+            if not quality['passed']:
+                return jsonify({'error': quality['message'], 'quality': quality}), 422
+        
+        session_key = f"{session.get('user_id')}:{stream_id}"
+        face_detected, face_image = get_face_tracker(session_key).detect(image)
+        if not face_detected:
+            return jsonify({'error': 'No face detected in the image'}), 400
+        
+        # Frames whose face is too small to analyze stay out of the session, like single uploads
+        if app.config['QUALITY_GATE']:
+            quality = check_face_quality(face_image, image.shape)
+            if not quality['passed']:
+                return jsonify({'error': quality['message'], 'quality': quality}), 422
+        
+        face_image = normalize_face_crop(face_image, image_info, app.config['ANALYSIS_MAX_SIDE'])
+        stream = get_stream_session(session_key, owner=session.get('user_id'))
+        analysis = stream.add_frame(face_image, image_info, (data, file.filename))
+        
+        return jsonify({
+            'success': True,
+            'analysis': analysis,
+            'health_score': calculate_skin_health_score(analysis),
+            'stream': stream.stats()
+        })
+    
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/analyze/stream/end', methods=['POST'])
+@login_required
+def analyze_stream_end():
+    """Finish a webcam session and store one report with its stabilized result"""
+    try:
+        stream_id = request.form.get('stream_id') or (request.get_json(silent=True) or {}).get('stream_id')
+        session_key = f"{session.get('user_id')}:{stream_id}"
+        end_tracking(session_key)
+        stream = end_stream_session(session_key)
+        if stream is None or not stream.frames:
+            return jsonify({'error': 'No frames were analyzed in this session'}), 400
+        
+        analysis = stream.result()
+        analysis['image_info'] = stream.image_info
+        analysis['stream'] = stream.stats()
+        
+        health_score = calculate_skin_health_score(analysis)
+        skin_type = classify_skin_type(analysis)
+        recommendations = get_skincare_recommendations(skin_type, analysis)
+        
+        # Only the last frame is kept with the report
+        filepath = save_upload(*stream.upload)
+        report_id = save_report(filepath, skin_type, health_score, analysis, recommendations)
+        
+        return jsonify({
+            'success': True,
+            'report_id': report_id,
+            'skin_type': skin_type,
+            'health_score': health_score,
+            'analysis': analysis,
+            'recommendations': recommendations,
+            'image_path': filepath
+        })
+    
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/chat', methods=['POST'])
 @login_required
 def chat():
@@ -512,25 +698,39 @@ def compare():
         before_file = request.files['before']
         after_file = request.files['after']
         
-        # Save both images
-        before_filename = f"before_{uuid.uuid4()}.{before_file.filename.rsplit('.', 1)[1].lower()}"
-        after_filename = f"after_{uuid.uuid4()}.{after_file.filename.rsplit('.', 1)[1].lower()}"
+        if not allowed_file(before_file.filename) or not allowed_file(after_file.filename):
+            return jsonify({'error': 'Invalid file type'}), 400
         
-        before_path = os.path.join(app.config['UPLOAD_FOLDER'], before_filename)
-        after_path = os.path.join(app.config['UPLOAD_FOLDER'], after_filename)
+        # Decode both images in memory
+        before_image, before_data, before_info = read_upload(before_file)
+        after_image, after_data, after_info = read_upload(after_file)
         
-        before_file.save(before_path)
-        after_file.save(after_path)
+        if before_image is None or after_image is None:
+            return jsonify({'error': 'Could not read one or both images'}), 400
         
-        # Analyze both
-        before_face_detected, before_face = detect_face(before_path)
-        after_face_detected, after_face = detect_face(after_path)
+        before_path = save_upload(before_data, before_file.filename, prefix='before_')
+        after_path = save_upload(after_data, after_file.filename, prefix='after_')
+        
+        # Detect both faces in one batch
+        (before_face_detected, before_face, _), (after_face_detected, after_face, _) = \
+            detect_faces_batch([before_image, after_image])
         
         if not before_face_detected or not after_face_detected:
             return jsonify({'error': 'Face not detected in one or both images'}), 400
         
-        before_analysis = analyze_skin(before_path, before_face)
-        after_analysis = analyze_skin(after_path, after_face)
+        before_face = normalize_face_crop(before_face, before_info, app.config['ANALYSIS_MAX_SIDE'])
+        after_face = normalize_face_crop(after_face, after_info, app.config['ANALYSIS_MAX_SIDE'])
+        
+        before_analysis = analyze_skin(
+            before_path, before_face, app.config['ANALYSIS_WORKING_SIDE'], parallel=app.config['ANALYSIS_PARALLEL'],
+            scale=analysis_scale(before_info)
+        )
+        after_analysis = analyze_skin(
+            after_path, after_face, app.config['ANALYSIS_WORKING_SIDE'], parallel=app.config['ANALYSIS_PARALLEL'],
+            scale=analysis_scale(after_info)
+        )
+        before_analysis['image_info'] = before_info
+        after_analysis['image_info'] = after_info
         
         before_score = calculate_skin_health_score(before_analysis)
         after_score = calculate_skin_health_score(after_analysis)
@@ -558,6 +758,21 @@ def compare():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/detector_stats')
+@login_required
+def detector_stats():
+    """
+    Face detector load-time and cache-hit counters, skin detector timings, analysis buffer
+    reuse and the loaded skin classifier version
+    """
+    return jsonify({
+        'success': True,
+        'detectors': get_detector_stats(),
+        'skin_detectors': get_skin_detector_stats(),
+        'analysis_arenas': arena_pool.stats(),
+        'skin_classifier': skin_model_registry.stats()
+    })
+
 @app.route('/report/<report_id>')
 @login_required
 def get_report(report_id):
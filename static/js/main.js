@@ -57,6 +57,8 @@ imageUpload.addEventListener('change', (e) => {
 
 // Webcam
 const webcamBtn = document.getElementById('webcamBtn');
+// Frames captured from this page share a stream ID so the server can track the face between them
+const webcamStreamId = generateUUID();
 const webcamModal = document.getElementById('webcamModal');
 const video = document.getElementById('video');
 const canvas = document.getElementById('canvas');
@@ -582,6 +584,9 @@ analyzeBtn.addEventListener('click', async () => {
     
     const formData = new FormData();
     formData.append('image', file);
+    if (file.name === 'webcam-capture.jpg') {
+        formData.append('stream_id', webcamStreamId);
+    }
     
     try {
         const response = await fetch('/analyze', {
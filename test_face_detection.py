@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+"""
+Test script for face detection
+"""
+import cv2
+import numpy as np
+
+from utils.face_detection import (
+    FaceDetectorBackend, available_backends, best_dnn_boxes, box_iou, check_proxy_fidelity, detect_face,
+    detect_faces_batch, detector_pools, face_backends, fallback_backends, get_detector_stats, locate_face_haar,
+    select_face_backend, warm_up_detectors
+)
+from utils.face_tracking import FaceTracker
+from utils.image_ingest import ingest_image
+
+def make_test_face(size=960):
+    """Draw a simple synthetic face that the Haar cascade picks up"""
+    image = np.full((size, size, 3), (200, 210, 220), np.uint8)
+    cx, cy = size // 2, size // 2
+    s = size / 480
+    cv2.ellipse(image, (cx, cy), (int(110 * s), int(145 * s)), 0, 0, 360, (140, 170, 215), -1)
+    for dx in (-45, 45):
+        cv2.ellipse(image, (cx + int(dx * s), cy - int(35 * s)), (int(22 * s), int(10 * s)), 0, 0, 360, (40, 40, 40), -1)
+        cv2.line(image, (cx + int((dx - 25) * s), cy - int(60 * s)), (cx + int((dx + 25) * s), cy - int(62 * s)),
+                 (30, 30, 30), max(1, int(6 * s)))
+    cv2.line(image, (cx, cy - int(20 * s)), (cx, cy + int(30 * s)), (110, 130, 170), max(1, int(6 * s)))
+    cv2.ellipse(image, (cx, cy + int(70 * s)), (int(40 * s), int(12 * s)), 0, 0, 360, (60, 60, 150), -1)
+    # Soften the edges so it looks more like a photo than a drawing
+    kernel = (size // 60) | 1
+    return cv2.GaussianBlur(image, (kernel, kernel), 0)
+
+def test_detector_pool_reuse(tmp_path):
+    """Repeated detections reuse the pooled cascade instead of reloading it"""
+    image_path = str(tmp_path / 'face.jpg')
+    cv2.imwrite(image_path, make_test_face())
+    
+    warm_up_detectors()
+    loads_before = get_detector_stats()['haar']['loads']
+    for _ in range(3):
+        face_detected, face_image = detect_face(image_path)
+        assert face_detected
+        assert face_image is not None
+    
+    stats = get_detector_stats()['haar']
+    assert stats['loads'] == loads_before
+    assert stats['hits'] >= 3
+    assert stats['load_time_ms'] > 0
+
+def test_detector_pool_checkout_is_exclusive():
+    """Nested checkouts never hand out the same instance twice"""
+    pool = detector_pools['haar']
+    with pool.checkout() as first:
+        with pool.checkout() as second:
+            assert first is not second
+
+def test_detect_face_from_memory():
+    """Uploads decoded in memory go through detection without touching disk"""
+    ok, encoded = cv2.imencode('.jpg', make_test_face())
+    assert ok
+    image, info = ingest_image(encoded.tobytes())
+    assert image is not None
+    assert (info['width'], info['height']) == (image.shape[1], image.shape[0])
+    
+    face_detected, face_image = detect_face(image)
+    assert face_detected
+    assert face_image.shape[0] < image.shape[0]
+    
+    assert ingest_image(b'not an image') == (None, {})
+    assert ingest_image(b'') == (None, {})
+
+def test_proxy_detection_fidelity():
+    """Boxes found on the downscaled proxy match the full-resolution boxes"""
+    images = [make_test_face(size) for size in (480, 1200, 3000)]
+    for result in check_proxy_fidelity(images, max_side=640):
+        assert result['full_box'] is not None
+        assert result['proxy_box'] is not None
+        assert result['iou'] > 0.85, result
+
+def test_large_image_crop_is_full_resolution():
+    """The crop comes from the original pixels, not from the proxy"""
+    face_detected, face_image = detect_face(make_test_face(2000), max_side=640)
+    assert face_detected
+    assert min(face_image.shape[:2]) > 1000
+
+def test_best_dnn_boxes_groups_by_image():
+    """Rows of a batched SSD output are assigned to the image they belong to"""
+    detections = np.array([[[
+        [0, 1, 0.90, 0.10, 0.10, 0.50, 0.60],
+        [0, 1, 0.95, 0.25, 0.25, 0.75, 0.75],
+        [1, 1, 0.40, 0.00, 0.00, 1.00, 1.00],
+        [2, 1, 0.80, -0.25, 0.50, 0.50, 1.25],
+    ]]], dtype=np.float32)
+    boxes = best_dnn_boxes(detections, [(100, 200), (100, 100), (100, 100)])
+    
+    assert boxes[0] == (50, 25, 100, 50)
+    assert boxes[1] is None  # below the confidence threshold
+    assert boxes[2] == (0, 50, 50, 50)  # clipped to the image
+
+def test_detect_faces_batch():
+    """Batch detection returns one result per input, in order"""
+    blank = np.full((480, 480, 3), 128, np.uint8)
+    results = detect_faces_batch([make_test_face(960), blank, make_test_face(1200)])
+    
+    assert [result[0] for result in results] == [True, False, True]
+    assert results[1][1] is None
+    x, y, w, h = results[2][2]
+    assert w > 0 and h > 0
+    assert results[2][1].shape[:2] == detect_face(make_test_face(1200))[1].shape[:2]
+
+def test_face_tracker_follows_moving_face():
+    """Consecutive frames are found around the last box; a lost face triggers a full search"""
+    face = make_test_face(960)
+    tracker = FaceTracker()
+    frames = [np.roll(face, shift, axis=1) for shift in (0, 10, 20, 30)]
+    
+    for frame in frames:
+        face_detected, face_image = tracker.detect(frame)
+        assert face_detected
+        tracked_box = tracker.last_box
+        full_box = locate_face_haar(frame)
+        assert box_iou(tracked_box, full_box) > 0.8
+    
+    assert tracker.full_detections == 1
+    assert tracker.tracked_frames == len(frames) - 1
+    
+    blank = np.full_like(face, 128)
+    assert tracker.detect(blank) == (False, None)
+    assert tracker.last_box is None
+    assert tracker.full_detections == 2
+
+def test_face_tracker_keeps_crop_steady():
+    """Detection jitter between frames does not move the crop, a large move does"""
+    face = make_test_face(960)
+    tracker = FaceTracker()
+    crops = [tracker.detect(np.roll(face, shift, axis=1))[1] for shift in (0, 2, 4, 1)]
+    first_box = tracker.crop_box
+    
+    assert tracker.steady_frames == 3
+    assert all(crop.shape == crops[0].shape for crop in crops)
+    
+    tracker.detect(np.roll(face, 100, axis=1))
+    assert tracker.crop_box != first_box
+    assert box_iou(tracker.crop_box, tracker.last_box) == 1.0
+
+def test_backend_selection_policy():
+    """The tier policy honours latency budgets and load, skipping unavailable backends"""
+    warm_up_detectors()
+    haar = face_backends['haar']
+    assert haar.latency_ms is not None
+    
+    # Nothing fits a zero budget, so the fastest available backend is used
+    fastest = select_face_backend(latency_budget_ms=0)
+    assert fastest.available()
+    assert fastest.tier in ('fast', 'medium')
+    
+    # A generous budget allows the most accurate available backend
+    accurate = select_face_backend(latency_budget_ms=1e9)
+    expected = 'dnn' if face_backends['dnn'].available() else 'haar'
+    assert accurate.name == expected
+    
+    # Default tier at low load, fast tier (or the next available) at high load
+    assert select_face_backend(load=0).name == 'haar'
+    busy = select_face_backend(load=10)
+    assert busy.name == ('lbp' if face_backends['lbp'].available() else 'haar')
+
+def test_detect_face_with_explicit_backend():
+    """Detection through a named backend records its latency"""
+    calls_before = face_backends['haar'].calls
+    face_detected, face_image = detect_face(make_test_face(960), backend='haar')
+    assert face_detected
+    assert face_backends['haar'].calls == calls_before + 1
+    assert get_detector_stats()['haar']['latency_ms'] > 0
+
+def test_accurate_tier_miss_falls_back():
+    """When the accurate tier finds nothing, the faster tiers still get their try"""
+    missing = FaceDetectorBackend('dnn', 'accurate', lambda image, max_side: None, lambda: True)
+    original = face_backends['dnn']
+    face_backends['dnn'] = missing
+    try:
+        assert select_face_backend(latency_budget_ms=1e9) is missing
+        fallbacks = fallback_backends(missing)
+        assert set(fallbacks) == set(available_backends()) - {missing}
+        # Nearest tier first
+        assert fallbacks[0].name == 'haar'
+        
+        face_detected, _ = detect_face(make_test_face(), latency_budget_ms=1e9)
+        assert face_detected and missing.calls == 1
+    finally:
+        face_backends['dnn'] = original
+
+if __name__ == '__main__':
+    import pathlib
+    import tempfile
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        test_detector_pool_reuse(pathlib.Path(tmp))
+    test_detector_pool_checkout_is_exclusive()
+    test_detect_face_from_memory()
+    test_proxy_detection_fidelity()
+    test_large_image_crop_is_full_resolution()
+    test_best_dnn_boxes_groups_by_image()
+    test_detect_faces_batch()
+    test_face_tracker_follows_moving_face()
+    test_face_tracker_keeps_crop_steady()
+    test_backend_selection_policy()
+    test_detect_face_with_explicit_backend()
+    test_accurate_tier_miss_falls_back()
+    print("Face detection tests passed!")
+    print(get_detector_stats())
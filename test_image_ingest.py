@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Test script for upload ingest
+"""
+import cv2
+import numpy as np
+
+from test_face_detection import make_test_face
+from utils.image_ingest import analysis_scale, ingest_image, normalize_face_crop, read_image_size
+from utils.image_quality import check_face_quality, check_frame_quality
+
+def make_upload(width, height, ext='.jpg'):
+    image = np.zeros((height, width, 3), np.uint8)
+    image[:, :width // 2] = (40, 120, 200)
+    ok, encoded = cv2.imencode(ext, image)
+    assert ok
+    return encoded.tobytes()
+
+def test_read_image_size():
+    """Dimensions come from the file header"""
+    assert read_image_size(make_upload(640, 480, '.jpg')) == (640, 480)
+    assert read_image_size(make_upload(300, 500, '.png')) == (300, 500)
+    assert read_image_size(b'not an image') is None
+
+def test_ingest_bounds_resolution():
+    """Large JPEGs are decoded at reduced scale and bounded to max_side"""
+    image, info = ingest_image(make_upload(4000, 3000), max_side=1600)
+    
+    assert image.shape == (1200, 1600, 3)
+    assert info['original_width'] == 4000
+    assert info['original_height'] == 3000
+    assert info['decode_scale'] == 2
+    
+    # Small uploads are left alone
+    image, info = ingest_image(make_upload(640, 480), max_side=1600)
+    assert image.shape == (480, 640, 3)
+    assert info['decode_scale'] == 1
+    
+    image, info = ingest_image(b'', max_side=1600)
+    assert image is None
+
+def test_normalize_face_crop():
+    """Face crops are bounded before analysis and the sizes are recorded"""
+    face = np.zeros((1500, 1200, 3), np.uint8)
+    info = {}
+    normalized = normalize_face_crop(face, info, max_side=1000)
+    
+    assert normalized.shape == (1000, 800, 3)
+    assert info['face_width'] == 1200
+    assert info['analysis_height'] == 1000
+    
+    small = np.zeros((200, 150, 3), np.uint8)
+    assert normalize_face_crop(small, max_side=1000) is small
+
+def test_analysis_scale():
+    """The scale covers the reduced decode, the ingest resize and the face crop normalization"""
+    image, info = ingest_image(make_upload(4000, 3000), max_side=1600)
+    normalize_face_crop(image[:1200, :900], info, max_side=1000)
+    assert np.isclose(analysis_scale(info), 1600 / 4000 * 1000 / 1200)
+    
+    _, info = ingest_image(make_upload(640, 480), max_side=1600)
+    normalize_face_crop(np.zeros((300, 200, 3), np.uint8), info, max_side=1000)
+    assert analysis_scale(info) == 1.0
+    assert analysis_scale({}) == 1.0
+
+def test_quality_gate():
+    """Blurry, dark and overexposed frames are rejected with a reason"""
+    face = make_test_face(960)
+    assert check_frame_quality(face)['passed']
+    
+    blurry = cv2.GaussianBlur(face, (31, 31), 0)
+    assert check_frame_quality(blurry)['reason'] == 'blurry'
+    
+    dark = (face * 0.15).astype(np.uint8)
+    assert check_frame_quality(dark)['reason'] == 'too_dark'
+    
+    overexposed = cv2.add(face, np.full_like(face, 120))
+    result = check_frame_quality(overexposed)
+    assert not result['passed']
+    assert result['reason'] == 'overexposed'
+    assert result['message']
+    assert 'brightness' in result['metrics']
+
+def test_face_fraction_gate():
+    """Faces covering a tiny part of the frame are rejected"""
+    frame_shape = (1000, 1000, 3)
+    assert check_face_quality(np.zeros((400, 400, 3), np.uint8), frame_shape)['passed']
+    assert check_face_quality(np.zeros((100, 100, 3), np.uint8), frame_shape)['reason'] == 'face_too_small'
+
+if __name__ == '__main__':
+    test_read_image_size()
+    test_ingest_bounds_resolution()
+    test_normalize_face_crop()
+    test_analysis_scale()
+    test_quality_gate()
+    test_face_fraction_gate()
+    print("Image ingest tests passed!")
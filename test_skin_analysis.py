@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+"""
+Test script for skin analysis
+"""
+import cv2
+import numpy as np
+import pytest
+
+from test_face_detection import make_test_face
+from utils.batch_analysis import analyze_skin_batch, batch_chunks
+from utils.buffer_arena import BufferArena, arena_pool
+from utils.color_tables import RED_HSV_RANGES, color_histogram, color_statistics
+from utils.face_tracking import FaceTracker
+from utils.image_ingest import resize_to_max_side
+from utils.resolution_calibration import calibrate_working_resolution
+from utils.stream_analysis import STREAM_MAX_SESSIONS, StreamingAnalysis, get_stream_session, stabilize, stream_sessions
+from utils import skin_analysis
+from utils.skin_analysis import (
+    ACNE_MAX_AREA, ACNE_MIN_AREA, FACIAL_ZONES, HEATMAP_GRID, SkinFeatures, analyze_skin, analyze_zones,
+    calculate_skin_health_score, count_acne_spots, decode_heatmap, get_skin_detector_stats, plane_levels,
+    skin_detectors, tile_counts, tile_edges, tile_moments, zone_views
+)
+
+def make_face_crop(size=640):
+    """Face crop with some noise so every detector has something to measure"""
+    face = make_test_face(size)[size // 6:-size // 6, size // 6:-size // 6]
+    rng = np.random.default_rng(0)
+    return np.clip(face.astype(int) + rng.normal(0, 12, face.shape), 0, 255).astype(np.uint8)
+
+def test_analyze_skin_results():
+    """Every detector reports a score or severity with a level"""
+    analysis = analyze_skin(None, make_face_crop())
+    
+    assert set(analysis) == {
+        'acne_spots', 'dark_circles', 'redness', 'oiliness', 'dryness', 'uneven_tone', 'texture', 'skin_tone', 'zones'
+    }
+    zones = analysis.pop('zones')
+    skin_tone = analysis.pop('skin_tone')
+    assert skin_tone['category'] and skin_tone['undertone'] and 0 < skin_tone['coverage'] <= 1
+    for name, result in analysis.items():
+        value = result.get('severity', result.get('score'))
+        assert 0 <= value, name
+        assert result.get('level', result.get('smoothness')) is not None, name
+    
+    assert 0 <= calculate_skin_health_score(analysis) <= 100
+    assert analyze_skin(None, None) == {}
+    
+    assert set(zones) == {'t_zone', 'cheeks', 'under_eye'}
+    assert set(zones['cheeks']) == {'dryness', 'redness'}
+    assert set(analyze_skin(None, make_face_crop(), zones=False)) == set(analysis) | {'skin_tone'}
+
+def test_zones_are_views():
+    """Facial zones are views of the shared planes, not copies"""
+    features = SkinFeatures(make_face_crop(300))
+    for view in zone_views(features.gray, FACIAL_ZONES['t_zone']):
+        assert view.size > 0
+        assert np.shares_memory(view, features.gray)
+    
+    # A uniform crop has no oily T-zone or dark under-eye pixels
+    flat = SkinFeatures(np.full((200, 160, 3), 150, np.uint8))
+    assert analyze_zones(flat)['t_zone']['oiliness']['score'] == 0
+    assert analyze_zones(flat)['under_eye']['dark_circles']['severity'] == 0
+
+def test_feature_planes_are_shared():
+    """Derived planes are computed once and reused"""
+    features = SkinFeatures(make_face_crop(300))
+    gray = features.gray
+    
+    assert features.plane('gray') is gray
+    assert features.gradient_magnitude is features.gradient_magnitude
+    assert features.laplacian.dtype == np.float32
+
+def test_batch_matches_single_analysis():
+    """Batch analysis gives exactly the single-crop results, rescaled thresholds included"""
+    rng = np.random.default_rng(1)
+    crops = [make_face_crop(size) for size in (300, 480, 640)]
+    crops.append(rng.integers(0, 256, (150, 210, 3), dtype=np.uint8))
+    # Other aspect ratios are padded into the stack, not stretched
+    crops.append(cv2.resize(make_face_crop(400), (260, 400), interpolation=cv2.INTER_AREA))
+    
+    expected = [analyze_skin(None, crop, working_side=240) for crop in crops]
+    assert analyze_skin_batch(crops, 240) == expected
+    assert analyze_skin_batch(crops, 240, chunk_size=3) == expected
+    
+    scales = [0.5, 1.0, 0.8, 1.0, 0.6]
+    expected = [analyze_skin(None, crop, working_side=240, scale=scale) for crop, scale in zip(crops, scales)]
+    assert analyze_skin_batch(crops, 240, scales=scales) == expected
+
+def test_default_batch_stacks_several_crops():
+    """At the default settings, typical face crops are stacked several per chunk"""
+    crops = [make_face_crop(size) for size in (300, 360, 420, 480, 540)]
+    chunks = batch_chunks([crop.shape[:2] for crop in crops])
+    assert all(stop - start > 1 for start, stop in chunks)
+    assert batch_chunks([(300, 300)] * 5, chunk_size=2) == [(0, 2), (2, 4), (4, 5)]
+    
+    # Crops within the working side are analyzed as they are, like the face crops of /analyze
+    expected = [analyze_skin(None, crop) for crop in crops]
+    assert analyze_skin_batch(crops) == expected
+
+def test_working_resolution():
+    """Reduced working resolution keeps full-resolution thresholds and labels"""
+    face = make_face_crop(900)
+    
+    # Crops already within the working side are analyzed as they are
+    assert analyze_skin(None, face, working_side=1000) == analyze_skin(None, face)
+    
+    reduced = analyze_skin(None, face, working_side=300)
+    assert set(reduced) == set(analyze_skin(None, face))
+    assert reduced['acne_spots']['level'] == analyze_skin(None, face)['acne_spots']['level']
+    
+    # A crop that was downscaled before analysis is rescaled the same way when told the factor
+    small = resize_to_max_side(face, 300)
+    assert analyze_skin(None, small, scale=small.shape[0] / face.shape[0]) == reduced
+    
+    report = calibrate_working_resolution([face], working_sides=(450, 300), repeat=1)
+    assert [row['working_side'] for row in report['sides']] == [450, 300]
+    for row in report['sides']:
+        assert row['speedup'] > 0
+        assert 0 <= row['metrics']['texture']['label_agreement'] <= 1
+
+def test_buffer_arena_reuse():
+    """Intermediates are written into reused buffers without changing results"""
+    arena = BufferArena()
+    first = arena.get('plane', (40, 50), np.float32)
+    assert first.shape == (40, 50) and first.dtype == np.float32
+    # Smaller requests reuse the same memory
+    second = arena.get('plane', (30, 20, 3))
+    assert np.shares_memory(first, second)
+    assert arena.allocations == 1 and arena.reuses == 1
+    # Both requests shared one buffer, so the request's memory is the larger one
+    assert arena.request_stats()['peak_memory_bytes'] == 40 * 50 * 4
+    
+    face = make_face_crop(600)
+    expected = analyze_skin(None, face)
+    stats = {}
+    assert analyze_skin(None, face, stats=stats) == expected
+    assert stats['memory']['peak_memory_bytes'] > face.size
+    assert stats['memory']['buffers_allocated'] == 0
+    # The pool reports the memory of the last request for /detector_stats
+    assert arena_pool.stats()['last_request'] == stats['memory']
+    assert arena_pool.stats()['peak_request_bytes'] >= stats['memory']['peak_memory_bytes']
+    
+    features = SkinFeatures(face, arena=arena)
+    assert np.shares_memory(features.laplacian, arena.get('laplacian', face.shape[:2], np.float32))
+
+def test_streaming_recomputes_changed_tiles():
+    """Tile-wise updates give exactly the full analysis of the new frame"""
+    face = make_face_crop(480)
+    stream = StreamingAnalysis(window=1)
+    assert stream.add_frame(face) == analyze_skin(None, face)
+    
+    # Unchanged frame: nothing is recomputed
+    stream.add_frame(face.copy())
+    assert stream.stats()['recomputed_tiles'] == 16
+    
+    # A spot inside one tile only recomputes that tile
+    changed = face.copy()
+    changed[30:70, 30:70] = (40, 40, 170)
+    assert stream.add_frame(changed) == analyze_skin(None, changed)
+    assert stream.stats() == {'frames': 3, 'recomputed_tiles': 17, 'recomputed_fraction': round(17 / 48, 4)}
+
+def test_streaming_tracked_frames_reuse_tiles():
+    """With the tracker's steady crop, jittery detections of a still face recompute few tiles"""
+    face = make_test_face(960)
+    rng = np.random.default_rng(0)
+    tracker = FaceTracker()
+    stream = StreamingAnalysis()
+    for shift in (0, 1, 2, 1, 0):
+        frame = np.clip(np.roll(face, shift, axis=1) + rng.normal(0, 3, face.shape), 0, 255).astype(np.uint8)
+        stream.add_frame(tracker.detect(frame)[1])
+    
+    assert stream.stats()['recomputed_fraction'] < 0.5
+
+def test_stream_sessions_are_bounded():
+    """New sessions evict the least recently used ones, per user and overall"""
+    stream_sessions.clear()
+    first = get_stream_session('a:1', owner='a')
+    get_stream_session('a:2', owner='a')
+    assert get_stream_session('a:1', owner='a') is first
+    
+    # A third session of the same user evicts its least recently used one
+    get_stream_session('a:3', owner='a')
+    assert list(stream_sessions) == ['a:1', 'a:3']
+    
+    for user in range(STREAM_MAX_SESSIONS):
+        get_stream_session(f'{user}:1', owner=user)
+    assert len(stream_sessions) == STREAM_MAX_SESSIONS
+    assert 'a:1' not in stream_sessions and 'a:3' not in stream_sessions
+    stream_sessions.clear()
+
+def test_stream_result_is_windowed_median():
+    """Each metric reports the result of the median frame, so a single outlier frame is ignored"""
+    history = [
+        {'redness': {'severity': value, 'level': level}, 'zones': {'cheeks': {'redness': {'severity': value, 'level': level}}}}
+        for value, level in [(5.0, 'low'), (40.0, 'high'), (6.0, 'low')]
+    ]
+    stable = stabilize(history)
+    assert stable['redness'] == {'severity': 6.0, 'level': 'low'}
+    assert stable['zones']['cheeks']['redness'] == {'severity': 6.0, 'level': 'low'}
+
+def test_detector_selection_and_timing():
+    """Only the requested detectors run, each with its declared schema and timing"""
+    face = make_face_crop(400)
+    full = analyze_skin(None, face)
+    
+    stats = {}
+    analysis = analyze_skin(None, face, stats=stats, detectors=['oiliness', 'dryness'])
+    assert analysis == {'oiliness': full['oiliness'], 'dryness': full['dryness']}
+    assert set(stats['timings_ms']) == {'oiliness', 'dryness'}
+    
+    for name, result in full.items():
+        outputs = skin_detectors[name].outputs
+        assert set(result) == set(outputs), name
+        for key, kind in outputs.items():
+            assert isinstance(result[key], (int, float) if kind is float else kind), (name, key)
+    
+    assert get_skin_detector_stats()['oiliness']['calls'] >= 2
+    with pytest.raises(ValueError):
+        analyze_skin(None, face, detectors=['wrinkles'])
+
+def test_parallel_analysis():
+    """Parallel execution gives the sequential results, also when the pool is saturated"""
+    face = make_face_crop(500)
+    expected = analyze_skin(None, face)
+    assert analyze_skin(None, face, parallel=True) == expected
+    
+    # Every worker busy: the detectors run in the calling thread
+    skin_analysis._pool_in_flight += skin_analysis.ANALYSIS_WORKERS
+    try:
+        assert analyze_skin(None, face, parallel=True) == expected
+    finally:
+        skin_analysis._pool_in_flight -= skin_analysis.ANALYSIS_WORKERS
+    
+    assert plane_levels(['gradient_magnitude', 'lab']) == [['gray', 'lab'], ['sobel_x', 'sobel_y'], ['gradient_magnitude']]
+
+def test_detectors_declare_their_inputs():
+    """A detector never builds a plane it did not declare, so parallel detectors only read planes"""
+    face = make_face_crop(300)
+    for name, detector in skin_detectors.items():
+        features = SkinFeatures(face)
+        features.precompute(detector.inputs)
+        planes = features.computed_planes()
+        detector.run(features)
+        assert features.computed_planes() == planes, name
+
+def test_acne_counts_on_noisy_masks():
+    """Acne counting matches contourArea on every contour, also for masks with thousands of specks"""
+    rng = np.random.default_rng(2)
+    for blur in (1, 3, 7):
+        noise = cv2.GaussianBlur(rng.integers(0, 256, (600, 600), dtype=np.uint8), (blur, blur), 0)
+        _, mask = cv2.threshold(noise, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        
+        areas = [cv2.contourArea(contour) for contour in contours]
+        spots = [area for area in areas if ACNE_MIN_AREA < area < ACNE_MAX_AREA]
+        assert count_acne_spots(contours) == (len(spots), sum(spots))
+
+def test_color_tables_match_conversions():
+    """Redness and chroma spread from the color tables stay close to the full HSV/LAB conversions"""
+    rng = np.random.default_rng(3)
+    for size, noise in [(300, 3), (480, 12), (640, 25)]:
+        face = np.clip(make_face_crop(size).astype(int) + rng.normal(0, noise, (1, 1, 3)) * 4, 0, 255).astype(np.uint8)
+        colors = color_statistics(color_histogram(face))
+        assert colors['pixels'] == face.shape[0] * face.shape[1]
+        
+        hsv = cv2.cvtColor(face, cv2.COLOR_BGR2HSV)
+        red_pixels = sum(cv2.countNonZero(cv2.inRange(hsv, lower, upper)) for lower, upper in RED_HSV_RANGES)
+        assert abs(colors['red_pixels'] - red_pixels) / colors['pixels'] * 100 < 1.5
+        
+        _, std = cv2.meanStdDev(cv2.cvtColor(face, cv2.COLOR_BGR2LAB))
+        assert abs(colors['a_std'] - std[1, 0]) < 0.1
+        assert abs(colors['b_std'] - std[2, 0]) < 0.1
+    
+    # Zone histograms add up
+    halves = [face[:100], face[100:]]
+    assert color_statistics([color_histogram(half) for half in halves]) == pytest.approx(colors)
+
+def test_severity_heatmaps():
+    """Tile statistics from integral images match direct per-tile statistics, and heatmaps are opt-in"""
+    face = make_face_crop(500)
+    features = SkinFeatures(face)
+    counts, means, variances = tile_moments(features.laplacian, (3, 5))
+    rows, cols = tile_edges(face.shape, (3, 5))
+    for i in range(3):
+        for j in range(5):
+            tile = features.laplacian[rows[i]:rows[i + 1], cols[j]:cols[j + 1]]
+            assert counts[i, j] == tile.size
+            assert means[i, j] == pytest.approx(tile.mean(dtype=np.float64))
+            assert variances[i, j] == pytest.approx(tile.var(dtype=np.float64))
+    
+    assert 'heatmaps' not in analyze_skin(None, face)
+    analysis = analyze_skin(None, face, heatmaps=True, detectors=['redness', 'texture'])
+    assert set(analysis['heatmaps']) == {'redness', 'texture'}
+    skin_per_tile = tile_counts(face.shape, HEATMAP_GRID, features.skin_mask)
+    for name, heatmap in analysis['heatmaps'].items():
+        values = decode_heatmap(heatmap)
+        assert values.shape == HEATMAP_GRID
+        assert 0 <= values.min() <= values.max() <= 100
+        # Weighted by the skin pixels of each tile, the map averages to the global value
+        # (redness up to the color table error)
+        average = np.average(values, weights=skin_per_tile)
+        assert average == pytest.approx(analysis[name].get('severity', analysis[name].get('score')), abs=1.5)
+
+def test_skin_tone_uses_fixed_sample():
+    """Skin tone clusters a fixed number of pixels whatever the crop size"""
+    for size in (200, 1200):
+        lab = SkinFeatures(make_face_crop(size)).lab
+        assert len(skin_analysis.sample_skin_pixels(lab)) <= skin_analysis.SKIN_TONE_SAMPLE_PIXELS
+    
+    # Uniform crops: one cluster covering everything, categorized by the ITA
+    tan = analyze_skin(None, np.full((120, 100, 3), (90, 120, 170), np.uint8), detectors=['skin_tone'])['skin_tone']
+    assert tan['category'] == 'tan' and tan['coverage'] == 1
+    dark = analyze_skin(None, np.full((120, 100, 3), (40, 60, 90), np.uint8), detectors=['skin_tone'])['skin_tone']
+    assert dark['category'] == 'dark' and dark['ita'] < tan['ita']
+
+def test_skin_mask_statistics():
+    """Detectors measure the skin pixels only, and fall back to the whole crop without enough skin"""
+    face = make_face_crop(480)
+    features = SkinFeatures(face)
+    mask = features.skin_mask
+    assert mask is not None and 0.2 < features.skin_pixels() / mask.size < 1
+    # The background corner and the dark eyes and brows are not skin
+    assert not mask[:10, :10].any()
+    assert np.mean(mask[features.gray < 70] > 0) < 0.05
+    
+    _, std = cv2.meanStdDev(features.gray[mask > 0])
+    expected = skin_analysis.oiliness_result(std[0, 0] ** 2)
+    assert analyze_skin(None, face, detectors=['oiliness'])['oiliness'] == expected
+    
+    # A gray crop has no skin-colored pixels: the whole crop is analyzed as before
+    gray = np.full((200, 160, 3), 128, np.uint8)
+    assert SkinFeatures(gray).skin_mask is None
+    assert analyze_skin(None, gray)['redness']['severity'] == 0
+
+if __name__ == '__main__':
+    test_analyze_skin_results()
+    test_feature_planes_are_shared()
+    test_zones_are_views()
+    test_batch_matches_single_analysis()
+    test_default_batch_stacks_several_crops()
+    test_working_resolution()
+    test_buffer_arena_reuse()
+    test_streaming_recomputes_changed_tiles()
+    test_streaming_tracked_frames_reuse_tiles()
+    test_stream_sessions_are_bounded()
+    test_stream_result_is_windowed_median()
+    test_detector_selection_and_timing()
+    test_parallel_analysis()
+    test_detectors_declare_their_inputs()
+    test_acne_counts_on_noisy_masks()
+    test_color_tables_match_conversions()
+    test_severity_heatmaps()
+    test_skin_tone_uses_fixed_sample()
+    test_skin_mask_statistics()
+    print("Skin analysis tests passed!")
+    print(analyze_skin(None, make_face_crop()))
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Test script for skin type classification and scoring
+"""
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+from sklearn.dummy import DummyClassifier
+from sklearn.ensemble import RandomForestClassifier
+
+from utils.forest_inference import CompiledForest, compile_forest
+from utils.report_rescoring import rescore_reports
+from utils.skin_analysis import (
+    analysis_metrics, calculate_skin_health_score, calculate_skin_health_scores, is_complete_analysis
+)
+from utils.skin_classifier import (
+    ModelRegistry, classify_skin_type, classify_skin_types, fit_skin_classifier, save_skin_classifier,
+    synthetic_training_data, train_skin_classifier
+)
+
+# Values on and around every threshold of the rules
+EDGE_VALUES = [0, 9.99, 10, 15, 20, 25, 25.01, 30, 35, 40, 45, 50, 55, 60, 65, 70, 100]
+
+def make_analyses(count=20000, seed=0, complete=False):
+    """Random analyses mixing edge values, arbitrary floats, ints and (unless complete) missing metrics"""
+    rng = np.random.default_rng(seed)
+    names = [('acne_spots', 'severity'), ('dark_circles', 'severity'), ('redness', 'severity'),
+             ('uneven_tone', 'score'), ('oiliness', 'score'), ('dryness', 'score'), ('texture', 'score')]
+    analyses = [{}]
+    for _ in range(count):
+        analysis = {}
+        for name, key in names:
+            kind = rng.integers(1 if complete else 0, 5)
+            if kind == 0:
+                continue
+            value = (
+                float(rng.choice(EDGE_VALUES)) if kind == 1 else
+                int(rng.integers(0, 101)) if kind == 2 else
+                round(float(rng.uniform(0, 100)), 2)
+            )
+            analysis[name] = {key: value}
+        analyses.append(analysis)
+    return analyses
+
+def make_reports_db(db_path, analyses, skin_types):
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE reports (id TEXT PRIMARY KEY, skin_type TEXT, health_score REAL, analysis_data TEXT)')
+    conn.executemany(
+        'INSERT INTO reports VALUES (?, ?, ?, ?)',
+        [(str(i), skin_type, 0.0, json.dumps(a)) for i, (a, skin_type) in enumerate(zip(analyses, skin_types))]
+    )
+    conn.commit()
+    conn.close()
+
+def test_vectorized_scoring_matches_scalar():
+    """Array scoring and classification give exactly the scalar results"""
+    analyses = make_analyses()
+    metrics = analysis_metrics(analyses)
+    
+    scores = calculate_skin_health_scores(metrics)
+    assert [float(score) for score in scores] == [calculate_skin_health_score(a) for a in analyses]
+    assert list(classify_skin_types(metrics)) == [classify_skin_type(a) for a in analyses]
+
+def test_rescore_reports(tmp_path):
+    """Stored reports get the current rules' score and skin type; detector subsets are left alone"""
+    db_path = str(tmp_path / 'reports.db')
+    analyses = make_analyses(50, seed=1, complete=True) + make_analyses(50, seed=4)
+    make_reports_db(db_path, analyses, ['Normal'] * len(analyses))
+    partial = [i for i, analysis in enumerate(analyses) if analysis and not is_complete_analysis(analysis)]
+    assert partial
+    
+    report = rescore_reports(db_path)
+    assert report['reports'] == len(analyses) and report['skipped'] == len(partial)
+    conn = sqlite3.connect(db_path)
+    rows = dict((row[0], row[1:]) for row in conn.execute('SELECT id, skin_type, health_score FROM reports'))
+    conn.close()
+    for i, analysis in enumerate(analyses):
+        if i in partial:
+            assert rows[str(i)] == ('Normal', 0.0)
+        else:
+            assert rows[str(i)] == (classify_skin_type(analysis), calculate_skin_health_score(analysis))
+    assert rescore_reports(db_path)['changed'] == 0
+
+def constant_model(label):
+    return DummyClassifier(strategy='constant', constant=label).fit([[0, 0, 0, 0]], [label])
+
+def test_model_registry(tmp_path):
+    """The model is trained or loaded in the background, and swapped when the file changes"""
+    model_path = str(tmp_path / 'skin_classifier.pkl')
+    trained = []
+    
+    def trainer(path):
+        trained.append(path)
+        save_skin_classifier(constant_model('Oily'), path)
+    
+    registry = ModelRegistry(model_path, trainer, check_interval=0)
+    # Missing model: no model yet, training starts in the background
+    assert registry.get() is None
+    registry.wait()
+    assert trained == [model_path]
+    assert registry.get().predict([[0, 0, 0, 0]])[0] == 'Oily'
+    first = registry.stats()
+    assert first['loaded'] and first['trainings'] == 1 and first['loads'] == 1
+    
+    # Unchanged file: the same model object, nothing reloaded
+    model = registry.get()
+    assert registry.get() is model and registry.stats()['loads'] == 1
+    
+    # New file version: the old model keeps answering until the new one is loaded
+    save_skin_classifier(constant_model('Dry'), model_path)
+    assert registry.get() is model
+    registry.wait()
+    assert registry.get().predict([[0, 0, 0, 0]])[0] == 'Dry'
+    assert registry.stats()['sha256'] != first['sha256']
+    
+    # A corrupt file is not loaded, the last good model stays
+    with open(model_path, 'wb') as f:
+        f.write(b'not a model')
+    registry.get()
+    registry.wait()
+    assert registry.get().predict([[0, 0, 0, 0]])[0] == 'Dry'
+    assert registry.stats()['errors'] == 1
+    os.remove(model_path)
+
+def test_compiled_forest_matches_sklearn(tmp_path):
+    """The flattened forest predicts exactly like sklearn, for single rows and batches"""
+    rng = np.random.default_rng(2)
+    X = rng.uniform(0, 100, (500, 4))
+    y = classify_skin_types(analysis_metrics([
+        {'oiliness': {'score': o}, 'dryness': {'score': d}, 'acne_spots': {'severity': a}, 'redness': {'severity': r}}
+        for o, d, a, r in X
+    ]))
+    forest = RandomForestClassifier(n_estimators=20, random_state=0).fit(X, y)
+    compiled = compile_forest(forest)
+    
+    # Random rows plus rows sitting exactly on split thresholds
+    thresholds = np.concatenate([estimator.tree_.threshold[estimator.tree_.feature >= 0] for estimator in forest.estimators_])
+    batch = np.vstack([rng.uniform(-10, 110, (2000, 4)), rng.choice(thresholds, (2000, 4))])
+    assert np.array_equal(compiled.predict(batch), forest.predict(batch))
+    assert np.allclose(compiled.predict_proba(batch), forest.predict_proba(batch))
+    for row in batch[:50]:
+        assert compiled.predict(row)[0] == forest.predict(row.reshape(1, -1))[0]
+        assert compiled.predict([row])[0] == forest.predict(row.reshape(1, -1))[0]
+    
+    for width in (3, 5):
+        with pytest.raises(ValueError):
+            compiled.predict(np.zeros((2, width)))
+    
+    # The registry serves the compiled form of a saved forest
+    model_path = str(tmp_path / 'skin_classifier.pkl')
+    save_skin_classifier(forest, model_path)
+    registry = ModelRegistry(model_path, check_interval=0)
+    registry.warm_up()
+    assert isinstance(registry.get(), CompiledForest) and registry.stats()['compiled']
+    assert np.array_equal(registry.get().predict(batch), forest.predict(batch))
+
+def test_training_pipeline(tmp_path):
+    """The classifier trains on any number of synthetic samples or on the stored reports"""
+    X, y = synthetic_training_data(300)
+    assert X.shape == (300, 4) and len(y) == 300 and 'Sensitive' in y
+    
+    model, report = fit_skin_classifier(X, y, n_jobs=1)
+    parallel_model, parallel_report = fit_skin_classifier(X, y, n_jobs=2)
+    assert report['samples'] == 300 and sum(report['classes'].values()) == 300
+    assert 0.5 < report['oob_accuracy'] <= 1 and report['train_time_ms'] > 0
+    # Worker count changes nothing but the training time
+    assert np.array_equal(model.predict(X), parallel_model.predict(X))
+    assert report['oob_accuracy'] == parallel_report['oob_accuracy']
+    
+    # Stored reports: the features of each analysis, labelled with its skin type; empty and partial ones are skipped
+    db_path = str(tmp_path / 'reports.db')
+    model_path = str(tmp_path / 'skin_classifier.pkl')
+    analyses = make_analyses(150, seed=3, complete=True) + make_analyses(50, seed=5)
+    make_reports_db(db_path, analyses, [classify_skin_type(a) for a in analyses])
+    model, report = train_skin_classifier(model_path, db_path=db_path, n_jobs=1)
+    assert report['source'] == db_path
+    assert report['samples'] == sum(1 for a in analyses if is_complete_analysis(a)) > 0
+    assert os.path.exists(model_path) and model.n_features_in_ == 4
+    
+    # A single skin type cannot be learned
+    single_path = str(tmp_path / 'single.db')
+    make_reports_db(single_path, analyses[:10], ['Normal'] * 10)
+    with pytest.raises(ValueError):
+        train_skin_classifier(model_path, db_path=single_path)
+
+if __name__ == '__main__':
+    import tempfile
+    from pathlib import Path
+    
+    test_vectorized_scoring_matches_scalar()
+    with tempfile.TemporaryDirectory() as directory:
+        test_rescore_reports(Path(directory))
+    with tempfile.TemporaryDirectory() as directory:
+        test_model_registry(Path(directory))
+    with tempfile.TemporaryDirectory() as directory:
+        test_compiled_forest_matches_sklearn(Path(directory))
+    with tempfile.TemporaryDirectory() as directory:
+        test_training_pipeline(Path(directory))
+    print("Skin classifier tests passed!")
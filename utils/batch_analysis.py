@@ -0,0 +1,120 @@
+import cv2
+import numpy as np
+
+from utils.image_ingest import FACE_MAX_SIDE, resize_to_max_side
+from utils.skin_analysis import SKIN_YCRCB_RANGE, SkinFeatures, analyze_features, refine_skin_mask
+
+# Crops of a batch are analyzed at most at this longest side, like the face crops of /analyze.
+# A smaller side works like analyze_skin(working_side=...): the resolution-dependent thresholds
+# are rescaled by each crop's own factor
+BATCH_WORKING_SIDE = FACE_MAX_SIDE
+# Pixels per stacked array (four 256x256 crops); bounds the memory a batch needs.
+# Taller stacks stop fitting in cache and the whole-stack filters slow down
+BATCH_CHUNK_PIXELS = 1 << 18
+# Reflected rows and columns around every crop in the stack, enough for the 5x5 blur,
+# so that filtering the whole stack at once gives exactly the per-crop result
+_PAD = 2
+
+def stack_face_crops(face_images):
+    """
+    Stack face crops of different sizes into one array, each at the top left of its own cell
+    Each crop gets _PAD reflected rows above and below and _PAD reflected columns to its
+    right; the rest of its cell is zero
+    Returns: uint8 array of shape (N, max height + 2 * _PAD, max width + _PAD, 3)
+    """
+    height = max(face_image.shape[0] for face_image in face_images)
+    width = max(face_image.shape[1] for face_image in face_images)
+    stack = np.zeros((len(face_images), height + 2 * _PAD, width + _PAD, 3), np.uint8)
+    for i, face_image in enumerate(face_images):
+        padded = cv2.copyMakeBorder(face_image, _PAD, _PAD, 0, _PAD, cv2.BORDER_REFLECT_101)
+        stack[i, :padded.shape[0], :padded.shape[1]] = padded
+    return stack
+
+def _analyze_chunk(face_images, scales, zones):
+    n = len(face_images)
+    stack = stack_face_crops(face_images)
+    cell_height, cell_width = stack.shape[1:3]
+    # All crops as one tall image, so every OpenCV call covers the whole chunk
+    tall = stack.reshape(n * cell_height, cell_width, 3)
+    
+    def crops(plane):
+        # Each crop's part of a plane of the tall image, without its padding
+        cells = plane.reshape((n, cell_height) + plane.shape[1:])
+        return [cells[i, _PAD:_PAD + h, :w] for i, (h, w) in enumerate(image.shape[:2] for image in face_images)]
+    
+    gray_tall = cv2.cvtColor(tall, cv2.COLOR_BGR2GRAY)
+    planes = {
+        'gray': crops(gray_tall),
+        'blurred_gray': crops(cv2.GaussianBlur(gray_tall, (5, 5), 0)),
+        'lab': crops(cv2.cvtColor(tall, cv2.COLOR_BGR2LAB)),
+        'laplacian': crops(cv2.Laplacian(gray_tall, cv2.CV_32F)),
+        'gradient_magnitude': crops(cv2.magnitude(
+            cv2.Sobel(gray_tall, cv2.CV_32F, 1, 0, ksize=3),
+            cv2.Sobel(gray_tall, cv2.CV_32F, 0, 1, ksize=3)
+        ))
+    }
+    # One color conversion and range check for the whole stack, then the morphology per crop,
+    # so that it sees each crop's own borders and none of the padding
+    planes['skin_mask'] = [
+        refine_skin_mask(mask)
+        for mask in crops(cv2.inRange(cv2.cvtColor(tall, cv2.COLOR_BGR2YCrCb), *SKIN_YCRCB_RANGE))
+    ]
+    
+    # The detectors of the single-image path, on views into the stacked planes
+    images = crops(tall)
+    return [
+        analyze_features(
+            SkinFeatures(images[i], scales[i], planes={name: plane[i] for name, plane in planes.items()}), zones
+        )
+        for i in range(n)
+    ]
+
+def batch_chunks(shapes, max_pixels=BATCH_CHUNK_PIXELS, chunk_size=None):
+    """
+    Split crops of these (height, width) shapes, in order, into chunks whose stacked cells
+    (every crop padded to the largest height and width of its chunk) stay within max_pixels
+    chunk_size additionally caps the number of crops per chunk
+    Returns: list of (start, stop) index ranges, at least one crop each
+    """
+    chunks = []
+    start, height, width = 0, 0, 0
+    for i, (h, w) in enumerate(shapes):
+        height, width = max(height, h), max(width, w)
+        full = chunk_size is not None and i - start == chunk_size
+        if i > start and (full or (i - start + 1) * height * width > max_pixels):
+            chunks.append((start, i))
+            start, height, width = i, h, w
+    if start < len(shapes):
+        chunks.append((start, len(shapes)))
+    return chunks
+
+def analyze_skin_batch(face_images, working_side=BATCH_WORKING_SIDE, chunk_size=None, zones=True, scales=None):
+    """
+    Analyze many face crops at once
+    Crops larger than working_side are downscaled to it (keeping their aspect ratio) and
+    stacked in chunks of at most BATCH_CHUNK_PIXELS. Color conversions and filters run once
+    per chunk, the detectors per crop on views into the stacked planes.
+    scales are the factors the crops were already downscaled by, as for analyze_skin.
+    Returns: list of analysis dicts, identical to analyze_skin(None, crop, working_side, scale=scale)
+    """
+    if scales is None:
+        scales = [1.0] * len(face_images)
+    
+    resized, resized_scales = [], []
+    for face_image, scale in zip(face_images, scales):
+        if working_side and max(face_image.shape[:2]) > working_side:
+            height = face_image.shape[0]
+            face_image = resize_to_max_side(face_image, working_side)
+            scale *= face_image.shape[0] / height
+        resized.append(face_image)
+        resized_scales.append(scale)
+    
+    # Crops of similar size share a chunk, so little of the stack is padding
+    order = sorted(range(len(resized)), key=lambda i: resized[i].shape[:2])
+    results = [None] * len(resized)
+    for start, stop in batch_chunks([resized[i].shape[:2] for i in order], chunk_size=chunk_size):
+        chunk = order[start:stop]
+        analyses = _analyze_chunk([resized[i] for i in chunk], [resized_scales[i] for i in chunk], zones)
+        for i, analysis in zip(chunk, analyses):
+            results[i] = analysis
+    return results
@@ -0,0 +1,103 @@
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+class BufferArena:
+    """
+    Reusable output buffers for the intermediates of one analysis at a time.
+    Each named buffer keeps the largest allocation it has needed so far and hands
+    out views of it shaped for the current crop, so crops of varying size reuse
+    the same memory instead of allocating new arrays on every request.
+    """
+    def __init__(self):
+        self._buffers = {}
+        self.allocations = 0
+        self.reuses = 0
+        self._request_sizes = {}
+        self._request_allocations = 0
+        # Detectors of one analysis may run on several threads
+        self._lock = threading.Lock()
+    
+    def get(self, name, shape, dtype=np.uint8):
+        """
+        Get an uninitialized array of the given shape and dtype, backed by the named buffer
+        Returns: numpy array (valid until the same name is requested again)
+        """
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        with self._lock:
+            buffer = self._buffers.get(name)
+            if buffer is None or buffer.nbytes < nbytes:
+                buffer = self._buffers[name] = np.empty(nbytes, np.uint8)
+                self.allocations += 1
+                self._request_allocations += 1
+            else:
+                self.reuses += 1
+            # A name requested again reuses its memory, so only its largest request counts
+            self._request_sizes[name] = max(nbytes, self._request_sizes.get(name, 0))
+        return buffer[:nbytes].view(dtype).reshape(shape)
+    
+    def begin(self):
+        """Start accounting for a new request"""
+        self._request_sizes = {}
+        self._request_allocations = 0
+    
+    def request_stats(self):
+        """
+        Memory used by the intermediates of the current request. They are all alive
+        until the analysis finishes, so the sum over the buffers, each at the largest
+        size it was requested at, is its peak intermediate memory.
+        """
+        return {
+            'peak_memory_bytes': sum(self._request_sizes.values()),
+            'buffers_allocated': self._request_allocations
+        }
+    
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+class ArenaPool:
+    """
+    Process-wide pool of arenas, one per analysis running at the same time.
+    A worker checks out an arena for exclusive use and returns it afterwards,
+    so buffers are never shared between concurrent requests.
+    """
+    def __init__(self):
+        self._idle = []
+        self._arenas = []
+        self.last_request = None
+        self.peak_request_bytes = 0
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def checkout(self):
+        with self._lock:
+            arena = self._idle.pop() if self._idle else None
+            if arena is None:
+                arena = BufferArena()
+                self._arenas.append(arena)
+        arena.begin()
+        try:
+            yield arena
+        finally:
+            request = arena.request_stats()
+            with self._lock:
+                self._idle.append(arena)
+                # Per-request memory is reported here instead of in the analysis results
+                self.last_request = request
+                self.peak_request_bytes = max(self.peak_request_bytes, request['peak_memory_bytes'])
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'arenas': len(self._arenas),
+                'bytes': sum(arena.nbytes for arena in self._arenas),
+                'allocations': sum(arena.allocations for arena in self._arenas),
+                'reuses': sum(arena.reuses for arena in self._arenas),
+                'last_request': self.last_request,
+                'peak_request_bytes': self.peak_request_bytes
+            }
+
+arena_pool = ArenaPool()
@@ -0,0 +1,32 @@
+# Train the skin type classifier and report how long it took and how accurate it is:
+#     python -m utils.classifier_training [--samples N] [--db skincare.db] [--jobs N] [--model PATH]
+# Trains on the reports stored in --db when given, otherwise on --samples synthetic samples.
+# A running app picks up the new model file without a restart.
+import argparse
+import sys
+
+from utils.skin_classifier import MODEL_PATH, TRAINING_JOBS, TRAINING_SAMPLES, train_skin_classifier
+
+def main(args):
+    parser = argparse.ArgumentParser(prog='python -m utils.classifier_training')
+    parser.add_argument('--samples', type=int, default=TRAINING_SAMPLES, help='synthetic samples to train on')
+    parser.add_argument('--db', help='train on the reports stored in this database instead')
+    parser.add_argument('--jobs', type=int, default=TRAINING_JOBS, help='cores to train on (-1: all)')
+    parser.add_argument('--model', default=MODEL_PATH, help='where to save the model')
+    options = parser.parse_args(args)
+    
+    try:
+        _, report = train_skin_classifier(options.model, options.samples, options.db, options.jobs)
+    except ValueError as e:
+        print(e)
+        return 1
+    
+    print(f"{report['samples']} samples from {report['source']}: {report['classes']}")
+    print(
+        f"trained in {report['train_time_ms']} ms on {report['jobs']} cores,"
+        f" out-of-bag accuracy {report['oob_accuracy']:.1%}, saved to {options.model}"
+    )
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,117 @@
+# Quantized BGR lookup tables for the color metrics. Every 8-bit BGR color is classified
+# once (red hue in HSV, a/b chroma in LAB) and the classes are averaged per bin of a
+# 3D color histogram, so the redness and tone of a crop come from one histogram pass
+# and a weighted sum over the bins instead of full color-space conversions.
+import os
+
+import cv2
+import numpy as np
+
+# Bits per channel of the histogram bins. 6 bits keeps redness within about 1.2
+# percentage points and the chroma deviations within 0.05 of the exact conversions.
+COLOR_TABLE_BITS = 6
+COLOR_TABLE_PATH = "models/color_tables.npz"
+
+# Red color range in HSV
+RED_HSV_RANGES = [
+    (np.array([0, 50, 50]), np.array([10, 255, 255])),
+    (np.array([170, 50, 50]), np.array([180, 255, 255]))
+]
+
+# Table columns: red-hue fraction, then mean a, a^2, b, b^2 of the colors in a bin.
+# Chroma is centred on 128 so the variances keep their precision.
+RED, A, A_SQUARED, B, B_SQUARED = range(5)
+
+def _table_key(bits):
+    """Everything the tables depend on; a cached file with another key is rebuilt"""
+    ranges = np.array(RED_HSV_RANGES).ravel()
+    return np.concatenate([[bits], ranges, [int(part) for part in cv2.__version__.split('.')[:3] if part.isdigit()]])
+
+def build_color_tables(bits=COLOR_TABLE_BITS):
+    """
+    Classify all 2^24 BGR colors, one blue bin at a time to bound memory
+    Returns: float64 array of shape (bins ** 3, 5), indexed like a flattened calcHist histogram
+    """
+    bins = 1 << bits
+    step = 256 // bins
+    values = np.arange(256, dtype=np.uint8)
+    green, red = np.meshgrid(values, values, indexing='ij')
+    
+    tables = np.empty((bins, bins, bins, 5))
+    for blue_bin in range(bins):
+        # All colors of this blue bin as one (step * 256, 256) image
+        chunk = np.empty((step, 256, 256, 3), np.uint8)
+        chunk[..., 0] = (blue_bin * step + np.arange(step, dtype=np.uint8))[:, None, None]
+        chunk[..., 1] = green
+        chunk[..., 2] = red
+        chunk = chunk.reshape(step * 256, 256, 3)
+        
+        hsv = cv2.cvtColor(chunk, cv2.COLOR_BGR2HSV)
+        is_red = sum(cv2.inRange(hsv, lower, upper) for lower, upper in RED_HSV_RANGES) / 255
+        lab = cv2.cvtColor(chunk, cv2.COLOR_BGR2LAB).astype(np.float64) - 128
+        a, b = lab[..., 1], lab[..., 2]
+        
+        for column, values_per_color in enumerate((is_red, a, a * a, b, b * b)):
+            # Average over the step x step x step colors of every (green, red) bin
+            binned = values_per_color.reshape(step, bins, step, bins, step)
+            tables[blue_bin, :, :, column] = binned.mean(axis=(0, 2, 4))
+    
+    return tables.reshape(-1, 5)
+
+def load_color_tables(path=COLOR_TABLE_PATH, bits=COLOR_TABLE_BITS):
+    """
+    Load the tables cached at path, building and caching them when missing or stale
+    Returns: float64 array of shape (bins ** 3, 5)
+    """
+    key = _table_key(bits)
+    if os.path.exists(path):
+        try:
+            with np.load(path) as cached:
+                if np.array_equal(cached['key'], key):
+                    return cached['tables']
+        except (OSError, ValueError, KeyError):
+            pass
+    
+    tables = build_color_tables(bits)
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, key=key, tables=tables)
+    except OSError:
+        # Read-only deployment: keep the tables in memory only
+        pass
+    return tables
+
+# Built once at import
+color_tables = load_color_tables()
+
+def color_histogram(image, mask=None, bits=COLOR_TABLE_BITS):
+    """
+    3D BGR histogram of an image (or a view of one), of the pixels under mask when given
+    Returns: float32 array of shape (bins, bins, bins)
+    """
+    bins = 1 << bits
+    return cv2.calcHist([image], [0, 1, 2], mask, [bins] * 3, [0, 256] * 3)
+
+def color_statistics(histograms, tables=None):
+    """
+    Redness and chroma spread of the pixels counted in one or more histograms
+    Returns: dict with pixels, red_pixels, a_std and b_std
+    """
+    if tables is None:
+        tables = color_tables
+    counts = sum(histogram.ravel() for histogram in histograms) if isinstance(histograms, list) else histograms.ravel()
+    
+    # Only the occupied bins are looked up: a crop fills a few percent of them, and the
+    # product over those rows is several times cheaper than streaming the whole table
+    occupied = np.flatnonzero(counts > 0)
+    weights = counts[occupied].astype(np.float64)
+    pixels = weights.sum()
+    sums = weights @ tables.take(occupied, axis=0)
+    
+    a_mean, b_mean = sums[A] / pixels, sums[B] / pixels
+    return {
+        'pixels': pixels,
+        'red_pixels': sums[RED],
+        'a_std': np.sqrt(max(sums[A_SQUARED] / pixels - a_mean ** 2, 0)),
+        'b_std': np.sqrt(max(sums[B_SQUARED] / pixels - b_mean ** 2, 0))
+    }
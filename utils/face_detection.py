@@ -1,104 +1,356 @@
 import cv2
 import numpy as np
+import os
+import threading
+import time
+from contextlib import contextmanager
 
-def detect_face(image_path):
+HAAR_CASCADE_PATH = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+DNN_PROTOTXT_PATH = "models/deploy.prototxt"
+DNN_MODEL_PATH = "models/res10_300x300_ssd_iter_140000.caffemodel"
+# LBP cascades are not bundled with opencv-python, drop one of these into models/ to enable the fast tier
+LBP_CASCADE_PATHS = ["models/lbpcascade_frontalface_improved.xml", "models/lbpcascade_frontalface.xml"]
+
+# Haar detection runs on a proxy no larger than this, faces are still cropped at full resolution
+DETECTION_MAX_SIDE = 640
+HAAR_MIN_FACE_SIZE = 100
+HAAR_WINDOW_SIZE = 24
+
+# res10 SSD input geometry
+DNN_INPUT_SIZE = (300, 300)
+DNN_MEAN = (104.0, 177.0, 123.0)
+DNN_CONFIDENCE_THRESHOLD = 0.5
+DNN_BATCH_SIZE = 16
+
+# Detector tiers from fastest to most accurate
+FACE_TIERS = ['fast', 'medium', 'accurate']
+DEFAULT_FACE_TIER = 'medium'
+# Latency guesses (ms) used until a backend has been measured
+DEFAULT_TIER_LATENCY_MS = {'fast': 10.0, 'medium': 30.0, 'accurate': 60.0}
+# Above this many in-flight detections per CPU core the fast tier is used
+HIGH_LOAD_THRESHOLD = 1.0
+
+class DetectorPool:
     """
-    Detect face in the image using OpenCV's Haar Cascade or DNN face detector
-    Returns: (face_detected: bool, face_image: numpy array)
+    Process-wide pool of detector instances for one model.
+    OpenCV detectors are not safe to share between threads, so each caller
+    checks out an instance for exclusive use and returns it afterwards.
+    Instances are only created when every existing one is busy.
     """
-    # Load image
-    image = cv2.imread(image_path)
-    if image is None:
-        return False, None
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self._idle = []
+        self._lock = threading.Lock()
+        self.instances = 0
+        self.loads = 0
+        self.load_time = 0.0
+        self.hits = 0
+    
+    def _load(self):
+        start = time.perf_counter()
+        detector = self.loader()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.loads += 1
+            self.load_time += elapsed
+            self.instances += 1
+        return detector
+    
+    @contextmanager
+    def checkout(self):
+        with self._lock:
+            detector = self._idle.pop() if self._idle else None
+            if detector is not None:
+                self.hits += 1
+        if detector is None:
+            detector = self._load()
+        try:
+            yield detector
+        finally:
+            with self._lock:
+                self._idle.append(detector)
+    
+    def warm_up(self):
+        """Make sure at least one instance is loaded"""
+        with self._lock:
+            if self.instances:
+                return
+        detector = self._load()
+        with self._lock:
+            self._idle.append(detector)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'instances': self.instances,
+                'loads': self.loads,
+                'load_time_ms': round(self.load_time * 1000, 3),
+                'hits': self.hits
+            }
+
+def _load_haar_cascade():
+    face_cascade = cv2.CascadeClassifier(HAAR_CASCADE_PATH)
+    if face_cascade.empty():
+        raise IOError(f"Could not load Haar cascade from {HAAR_CASCADE_PATH}")
+    return face_cascade
+
+def lbp_cascade_path():
+    """First LBP cascade found in models/, or None"""
+    for path in LBP_CASCADE_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+def _load_lbp_cascade():
+    path = lbp_cascade_path()
+    face_cascade = cv2.CascadeClassifier(path or '')
+    if face_cascade.empty():
+        raise IOError(f"Could not load LBP cascade from {path}")
+    return face_cascade
+
+def _load_dnn_model():
+    return cv2.dnn.readNetFromCaffe(DNN_PROTOTXT_PATH, DNN_MODEL_PATH)
+
+def dnn_model_available():
+    """DNN model files are optional and have to be downloaded separately"""
+    return os.path.exists(DNN_PROTOTXT_PATH) and os.path.exists(DNN_MODEL_PATH)
+
+# Shared by every request handled by this process
+detector_pools = {
+    'lbp': DetectorPool('lbp', _load_lbp_cascade),
+    'haar': DetectorPool('haar', _load_haar_cascade),
+    'dnn': DetectorPool('dnn', _load_dnn_model)
+}
+
+def warm_up_detectors():
+    """
+    Load the face detectors once at startup so requests never pay the load cost,
+    and run each backend once so the tier policy starts from measured latencies
+    """
+    sample = np.full((DETECTION_MAX_SIDE, DETECTION_MAX_SIDE, 3), 128, np.uint8)
+    for backend in face_backends.values():
+        if not backend.available():
+            continue
+        try:
+            detector_pools[backend.name].warm_up()
+            backend.locate(sample)
+        except Exception as e:
+            print(f"{backend.name} face detector warm-up failed: {e}")
+
+def get_detector_stats():
+    """Load-time, cache-hit and latency counters for each detector"""
+    stats = {}
+    for name, pool in detector_pools.items():
+        stats[name] = pool.stats()
+        stats[name].update(face_backends[name].stats())
+    return stats
+
+def load_image(image):
+    """Accept either an already decoded BGR array or a path to read from disk"""
+    if isinstance(image, np.ndarray):
+        return image
+    return cv2.imread(image)
+
+def crop_face(image, box, padding=20):
+    """Crop a face box (x, y, w, h) from the full-resolution image with some padding"""
+    x, y, w, h = box
+    x = max(0, x - padding)
+    y = max(0, y - padding)
+    w = min(image.shape[1] - x, w + 2 * padding)
+    h = min(image.shape[0] - y, h + 2 * padding)
     
+    return image[y:y+h, x:x+w]
+
+def locate_face_cascade(image, pool_name, max_side=DETECTION_MAX_SIDE, min_face=HAAR_MIN_FACE_SIZE, max_face=None):
+    """
+    Find the largest face with a cascade classifier (Haar or LBP)
+    Detection runs on a proxy downscaled so its longest side is at most max_side
+    (None for full resolution) and the box is mapped back to the original image
+    min_face/max_face bound the face size in original pixels
+    Returns: (x, y, w, h) in original image coordinates, or None
+    """
     # Convert to grayscale for face detection
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     
-    # Load face cascade classifier
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    scale = 1.0
+    if max_side and max(gray.shape[:2]) > max_side:
+        scale = max_side / max(gray.shape[:2])
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    
+    # Keep the face size limits constant in original pixels, but never below the cascade window
+    min_size = max(HAAR_WINDOW_SIZE, int(round(min_face * scale)))
+    max_size = max(min_size, int(round(max_face * scale))) if max_face else 0
     
-    # Detect faces
-    faces = face_cascade.detectMultiScale(
-        gray,
-        scaleFactor=1.1,
-        minNeighbors=5,
-        minSize=(100, 100)
-    )
+    # Detect faces with a pooled cascade classifier
+    with detector_pools[pool_name].checkout() as face_cascade:
+        faces = face_cascade.detectMultiScale(
+            gray,
+            scaleFactor=1.1,
+            minNeighbors=5,
+            minSize=(min_size, min_size),
+            maxSize=(max_size, max_size)
+        )
     
     if len(faces) == 0:
-        # Try DNN face detector as fallback
-        return detect_face_dnn(image_path)
+        return None
     
     # Get the largest face (assuming it's the main subject)
-    largest_face = max(faces, key=lambda rect: rect[2] * rect[3])
-    x, y, w, h = largest_face
+    x, y, w, h = max(faces, key=lambda rect: rect[2] * rect[3])
     
-    # Extract face region with some padding
-    padding = 20
-    x = max(0, x - padding)
-    y = max(0, y - padding)
-    w = min(image.shape[1] - x, w + 2 * padding)
-    h = min(image.shape[0] - y, h + 2 * padding)
+    if scale != 1.0:
+        x, y = int(round(x / scale)), int(round(y / scale))
+        w = min(image.shape[1] - x, int(round(w / scale)))
+        h = min(image.shape[0] - y, int(round(h / scale)))
+    
+    return (int(x), int(y), int(w), int(h))
+
+def locate_face_haar(image, max_side=DETECTION_MAX_SIDE, min_face=HAAR_MIN_FACE_SIZE, max_face=None):
+    """Find the largest face with the Haar cascade, see locate_face_cascade"""
+    return locate_face_cascade(image, 'haar', max_side, min_face, max_face)
+
+def locate_face_lbp(image, max_side=DETECTION_MAX_SIDE):
+    """Find the largest face with the LBP cascade, see locate_face_cascade"""
+    return locate_face_cascade(image, 'lbp', max_side)
+
+def locate_face_dnn(image, max_side=None):
+    """Find the most confident face with the DNN (the network input is always 300x300)"""
+    return locate_faces_dnn([image])[0]
+
+def detect_face(image, max_side=DETECTION_MAX_SIDE, latency_budget_ms=None, backend=None):
+    """
+    Detect face in the image using an LBP cascade, Haar Cascade or DNN face detector
+    Accepts a decoded BGR array or an image path
+    The backend is picked from the latency budget or current load unless given by name;
+    if it finds nothing the other available backends are tried as fallback
+    Large images are searched on a downscaled proxy, the crop is always full resolution
+    Returns: (face_detected: bool, face_image: numpy array)
+    """
+    image = load_image(image)
+    if image is None:
+        return False, None
+    
+    if backend is None:
+        backend = select_face_backend(latency_budget_ms)
+    elif isinstance(backend, str):
+        backend = face_backends[backend]
     
-    face_image = image[y:y+h, x:x+w]
+    with _count_in_flight():
+        for candidate in [backend] + fallback_backends(backend):
+            box = candidate.locate(image, max_side)
+            if box is not None:
+                return True, crop_face(image, box)
     
-    return True, face_image
+    return False, None
+
+def box_iou(box_a, box_b):
+    """Intersection over union of two (x, y, w, h) boxes"""
+    ax, ay, aw, ah = box_a
+    bx, by, bw, bh = box_b
+    inter_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    inter_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = inter_w * inter_h
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
 
-def detect_face_dnn(image_path):
+def check_proxy_fidelity(images, max_side=DETECTION_MAX_SIDE):
     """
-    Detect face using DNN face detector (more accurate but slower)
+    Compare proxy detection against the full-resolution path
+    Returns: list of dicts with both boxes, their IoU and the time each path took
     """
-    try:
-        # Load DNN model files (you may need to download these)
-        prototxt_path = "models/deploy.prototxt"
-        model_path = "models/res10_300x300_ssd_iter_140000.caffemodel"
+    results = []
+    for image in images:
+        image = load_image(image)
+        if image is None:
+            continue
         
-        # Try to load DNN model
-        net = cv2.dnn.readNetFromCaffe(prototxt_path, model_path)
+        start = time.perf_counter()
+        full_box = locate_face_haar(image, max_side=None)
+        full_ms = (time.perf_counter() - start) * 1000
         
-        image = cv2.imread(image_path)
-        if image is None:
-            return False, None
+        start = time.perf_counter()
+        proxy_box = locate_face_haar(image, max_side=max_side)
+        proxy_ms = (time.perf_counter() - start) * 1000
         
-        (h, w) = image.shape[:2]
+        if full_box is None or proxy_box is None:
+            iou = 1.0 if full_box == proxy_box else 0.0
+        else:
+            iou = box_iou(full_box, proxy_box)
         
-        # Create blob from image
-        blob = cv2.dnn.blobFromImage(cv2.resize(image, (300, 300)), 1.0, (300, 300), (104.0, 177.0, 123.0))
+        results.append({
+            'shape': image.shape[:2],
+            'full_box': full_box,
+            'proxy_box': proxy_box,
+            'iou': round(iou, 4),
+            'full_ms': round(full_ms, 3),
+            'proxy_ms': round(proxy_ms, 3)
+        })
+    
+    return results
+
+def best_dnn_boxes(detections, shapes, confidence_threshold=DNN_CONFIDENCE_THRESHOLD):
+    """
+    Pick the most confident face per image from an SSD output of shape (1, 1, N, 7)
+    Each row is [image_id, label, confidence, x0, y0, x1, y1] with relative coordinates
+    Returns: list with one (x, y, w, h) box or None per image shape
+    """
+    rows = detections.reshape(-1, 7)
+    rows = rows[rows[:, 2] > confidence_threshold]
+    
+    boxes = []
+    for image_id, (h, w) in enumerate(shapes):
+        candidates = rows[rows[:, 0] == image_id]
+        if len(candidates) == 0:
+            boxes.append(None)
+            continue
         
-        # Pass blob through network
-        net.setInput(blob)
-        detections = net.forward()
+        best = candidates[np.argmax(candidates[:, 2])]
+        box = best[3:7] * np.array([w, h, w, h])
+        (x, y, x1, y1) = box.astype("int")
         
-        # Find the face with highest confidence
-        max_confidence = 0
-        best_face = None
+        # Ensure coordinates are within image bounds
+        x = max(0, x)
+        y = max(0, y)
+        x1 = min(w, x1)
+        y1 = min(h, y1)
         
-        for i in range(0, detections.shape[2]):
-            confidence = detections[0, 0, i, 2]
-            
-            if confidence > 0.5 and confidence > max_confidence:
-                max_confidence = confidence
-                box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-                (x, y, x1, y1) = box.astype("int")
-                
-                # Ensure coordinates are within image bounds
-                x = max(0, x)
-                y = max(0, y)
-                x1 = min(w, x1)
-                y1 = min(h, y1)
-                
-                best_face = (x, y, x1 - x, y1 - y)
+        boxes.append((int(x), int(y), int(x1 - x), int(y1 - y)) if x1 > x and y1 > y else None)
+    
+    return boxes
+
+def locate_faces_dnn(images):
+    """
+    Run the DNN face detector on several images in a single forward pass
+    Returns: list with one (x, y, w, h) box or None per image
+    """
+    # Every image is resized to the network input, so they stack into one blob
+    resized = [cv2.resize(image, DNN_INPUT_SIZE) for image in images]
+    blob = cv2.dnn.blobFromImages(resized, 1.0, DNN_INPUT_SIZE, DNN_MEAN)
+    
+    # Pass blob through a pooled network
+    with detector_pools['dnn'].checkout() as net:
+        net.setInput(blob)
+        detections = net.forward()
+    
+    return best_dnn_boxes(detections, [image.shape[:2] for image in images])
+
+def detect_face_dnn(image):
+    """
+    Detect face using DNN face detector (more accurate but slower)
+    Accepts a decoded BGR array or an image path
+    """
+    # DNN model files are optional (you may need to download these)
+    if not dnn_model_available():
+        return False, None
+    
+    try:
+        image = load_image(image)
+        if image is None:
+            return False, None
         
-        if best_face:
-            x, y, w, h = best_face
-            padding = 20
-            x = max(0, x - padding)
-            y = max(0, y - padding)
-            w = min(image.shape[1] - x, w + 2 * padding)
-            h = min(image.shape[0] - y, h + 2 * padding)
-            
-            face_image = image[y:y+h, x:x+w]
-            return True, face_image
+        box = locate_faces_dnn([image])[0]
+        if box:
+            return True, crop_face(image, box)
         
         return False, None
     
@@ -106,3 +358,148 @@ def detect_face_dnn(image_path):
         # If DNN fails, return False
         return False, None
 
+def detect_faces_batch(images, batch_size=DNN_BATCH_SIZE):
+    """
+    Detect faces in many images at once
+    With the DNN model available every chunk of batch_size images costs one forward pass;
+    images it misses, or all images when the model is absent, go through the Haar cascade
+    Returns: list of (face_detected: bool, face_image: numpy array, box: (x, y, w, h)) per image
+    """
+    images = [load_image(image) for image in images]
+    valid = [i for i, image in enumerate(images) if image is not None]
+    boxes = [None] * len(images)
+    
+    if valid and dnn_model_available():
+        try:
+            for chunk_start in range(0, len(valid), batch_size):
+                chunk = valid[chunk_start:chunk_start + batch_size]
+                for i, box in zip(chunk, locate_faces_dnn([images[i] for i in chunk])):
+                    boxes[i] = box
+        except Exception as e:
+            print(f"Batched DNN face detection failed, using Haar cascade: {e}")
+    
+    results = []
+    for i, image in enumerate(images):
+        if image is None:
+            results.append((False, None, None))
+            continue
+        
+        box = boxes[i] or locate_face_haar(image)
+        if box is None:
+            results.append((False, None, None))
+        else:
+            results.append((True, crop_face(image, box), box))
+    
+    return results
+
+class FaceDetectorBackend:
+    """
+    One face detector in a latency tier, with its measured latency.
+    locate() never raises; a failing detector just finds no face.
+    """
+    def __init__(self, name, tier, locate, available):
+        self.name = name
+        self.tier = tier
+        self._locate = locate
+        self.available = available
+        self.calls = 0
+        self.latency_ms = None
+        self._lock = threading.Lock()
+    
+    def locate(self, image, max_side=DETECTION_MAX_SIDE):
+        start = time.perf_counter()
+        try:
+            box = self._locate(image, max_side)
+        except Exception as e:
+            print(f"{self.name} face detection failed: {e}")
+            box = None
+        self._record((time.perf_counter() - start) * 1000)
+        return box
+    
+    def _record(self, elapsed_ms):
+        with self._lock:
+            self.calls += 1
+            # Exponential moving average so the estimate follows the current machine load
+            if self.latency_ms is None:
+                self.latency_ms = elapsed_ms
+            else:
+                self.latency_ms = 0.8 * self.latency_ms + 0.2 * elapsed_ms
+    
+    def expected_latency_ms(self):
+        if self.latency_ms is None:
+            return DEFAULT_TIER_LATENCY_MS[self.tier]
+        return self.latency_ms
+    
+    def stats(self):
+        return {
+            'tier': self.tier,
+            'available': self.available(),
+            'calls': self.calls,
+            'latency_ms': round(self.latency_ms, 3) if self.latency_ms is not None else None
+        }
+
+# One backend per tier, keyed like detector_pools
+face_backends = {
+    'lbp': FaceDetectorBackend('lbp', 'fast', locate_face_lbp, lambda: lbp_cascade_path() is not None),
+    'haar': FaceDetectorBackend('haar', 'medium', locate_face_haar, lambda: True),
+    'dnn': FaceDetectorBackend('dnn', 'accurate', locate_face_dnn, dnn_model_available)
+}
+
+# Detections currently running in this process, used as the load signal
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+@contextmanager
+def _count_in_flight():
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += 1
+    try:
+        yield
+    finally:
+        with _in_flight_lock:
+            _in_flight -= 1
+
+def available_backends():
+    """Available backends ordered from fastest to most accurate tier"""
+    backends = [backend for backend in face_backends.values() if backend.available()]
+    return sorted(backends, key=lambda backend: FACE_TIERS.index(backend.tier))
+
+def fallback_backends(backend):
+    """
+    The other available backends, to try when the given one finds no face:
+    more accurate tiers first, then the less accurate ones from the nearest tier down,
+    so a miss of the most accurate tier still gets every other detector's chance
+    """
+    rank = FACE_TIERS.index(backend.tier)
+    backends = available_backends()
+    more_accurate = [other for other in backends if FACE_TIERS.index(other.tier) > rank]
+    less_accurate = [other for other in backends if FACE_TIERS.index(other.tier) < rank]
+    return more_accurate + less_accurate[::-1]
+
+def current_load():
+    """In-flight detections per CPU core"""
+    return _in_flight / (os.cpu_count() or 1)
+
+def select_face_backend(latency_budget_ms=None, load=None):
+    """
+    Pick a detector backend
+    With a latency budget: the most accurate backend whose measured latency fits,
+    or the fastest one if none does. Without one: the fast tier under high load,
+    the default tier otherwise. Unavailable tiers fall through to the next more accurate one.
+    """
+    backends = available_backends()
+    
+    if latency_budget_ms is not None:
+        fitting = [backend for backend in backends if backend.expected_latency_ms() <= latency_budget_ms]
+        return fitting[-1] if fitting else backends[0]
+    
+    if load is None:
+        load = current_load()
+    tier = 'fast' if load >= HIGH_LOAD_THRESHOLD else DEFAULT_FACE_TIER
+    
+    rank = FACE_TIERS.index(tier)
+    for backend in backends:
+        if FACE_TIERS.index(backend.tier) >= rank:
+            return backend
+    return backends[-1]
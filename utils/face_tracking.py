@@ -0,0 +1,145 @@
+import threading
+import time
+
+from utils.face_detection import box_iou, crop_face, detect_face_dnn, load_image, locate_face_haar
+
+# Search window around the last face, as a fraction of the face size on each side
+TRACKING_EXPAND = 0.5
+# The search window is itself searched on a small proxy, so cost stays flat
+TRACKING_MAX_SIDE = 320
+# Allowed change in face size between two frames
+TRACKING_SCALE_RANGE = (0.6, 1.6)
+# The face is cropped with the same box as long as the detected box overlaps it at least this
+# much, so detection jitter does not shift the crop content between frames
+TRACKING_STABLE_IOU = 0.85
+# Trackers idle for longer than this are dropped
+TRACKER_TTL = 600
+
+class FaceTracker:
+    """
+    Remember where the face was in the previous webcam frame and search only
+    an expanded window around it in the next one. Full-frame detection is only
+    needed for the first frame and whenever the face is lost.
+    The face is cropped with a steady box that only moves once the face has
+    moved past stable_iou.
+    """
+    def __init__(self, expand=TRACKING_EXPAND, stable_iou=TRACKING_STABLE_IOU):
+        self.expand = expand
+        self.stable_iou = stable_iou
+        self.last_box = None
+        self.crop_box = None
+        self.steady_frames = 0
+        self.last_used = time.time()
+        self.tracked_frames = 0
+        self.full_detections = 0
+        self._lock = threading.Lock()
+    
+    def _search_window(self, image_shape):
+        x, y, w, h = self.last_box
+        margin_x = int(w * self.expand)
+        margin_y = int(h * self.expand)
+        x0 = max(0, x - margin_x)
+        y0 = max(0, y - margin_y)
+        x1 = min(image_shape[1], x + w + margin_x)
+        y1 = min(image_shape[0], y + h + margin_y)
+        return x0, y0, x1, y1
+    
+    def _track(self, image):
+        """Look for the face near its last position, returns a full-frame box or None"""
+        x0, y0, x1, y1 = self._search_window(image.shape)
+        # A view into the frame, no copy
+        window = image[y0:y1, x0:x1]
+        
+        face_size = max(self.last_box[2], self.last_box[3])
+        box = locate_face_haar(
+            window,
+            max_side=TRACKING_MAX_SIDE,
+            min_face=int(face_size * TRACKING_SCALE_RANGE[0]),
+            max_face=int(face_size * TRACKING_SCALE_RANGE[1])
+        )
+        if box is None:
+            return None
+        
+        x, y, w, h = box
+        return (x + x0, y + y0, w, h)
+    
+    def locate(self, image):
+        """
+        Find the face box in the next frame
+        Returns: (x, y, w, h) or None if there is no face
+        """
+        with self._lock:
+            self.last_used = time.time()
+            
+            box = None
+            if self.last_box is not None:
+                box = self._track(image)
+                if box is not None:
+                    self.tracked_frames += 1
+            
+            if box is None:
+                # Face lost (or first frame), search the whole frame
+                box = locate_face_haar(image)
+                self.full_detections += 1
+            
+            self.last_box = box
+            return box
+    
+    def _steady_box(self, box):
+        """The previous crop box while box still overlaps it closely, otherwise box itself"""
+        with self._lock:
+            if self.crop_box is not None and box_iou(box, self.crop_box) >= self.stable_iou:
+                self.steady_frames += 1
+            else:
+                self.crop_box = box
+            return self.crop_box
+    
+    def detect(self, image):
+        """
+        Same contract as detect_face, for consecutive frames of one session
+        Returns: (face_detected: bool, face_image: numpy array)
+        """
+        image = load_image(image)
+        if image is None:
+            return False, None
+        
+        box = self.locate(image)
+        if box is None:
+            return detect_face_dnn(image)
+        
+        return True, crop_face(image, self._steady_box(box))
+    
+    def reset(self):
+        with self._lock:
+            self.last_box = None
+            self.crop_box = None
+    
+    def stats(self):
+        return {
+            'tracked_frames': self.tracked_frames,
+            'full_detections': self.full_detections,
+            'steady_frames': self.steady_frames,
+            'last_box': self.last_box
+        }
+
+# Session-scoped trackers (in-memory, like the chatbot conversation context)
+face_trackers = {}
+_trackers_lock = threading.Lock()
+
+def get_face_tracker(session_key):
+    """Get or create the tracker for one capture session"""
+    now = time.time()
+    with _trackers_lock:
+        # Drop trackers of sessions that went away
+        for key in [key for key, tracker in face_trackers.items() if now - tracker.last_used > TRACKER_TTL]:
+            del face_trackers[key]
+        
+        tracker = face_trackers.get(session_key)
+        if tracker is None:
+            tracker = face_trackers[session_key] = FaceTracker()
+        return tracker
+
+def end_tracking(session_key):
+    """Forget the tracker of a finished capture session"""
+    with _trackers_lock:
+        face_trackers.pop(session_key, None)
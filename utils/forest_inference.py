@@ -0,0 +1,98 @@
+# Flattened random forests for low-latency prediction. The nodes of all trees are
+# concatenated into a few NumPy arrays and every tree is walked at once, one level
+# per step, so classifying a row costs a handful of array operations instead of
+# sklearn's input validation and per-tree dispatch.
+import numpy as np
+
+class CompiledForest:
+    """
+    A trained RandomForestClassifier as flat node arrays.
+    Leaves point to themselves, so walking max-depth levels from the roots lands every
+    tree on its leaf whatever the row. predict and predict_proba match the forest's.
+    """
+    def __init__(self, features, thresholds, children, leaf_values, roots, depth, classes, n_features):
+        self.features = features
+        self.thresholds = thresholds
+        # children[2 * node] is the left child, children[2 * node + 1] the right one
+        self.children = children
+        self.leaf_values = leaf_values
+        self.roots = roots
+        self.depth = depth
+        self.classes_ = classes
+        self.n_features_in_ = n_features
+    
+    @property
+    def n_nodes(self):
+        return len(self.features)
+    
+    def apply(self, X):
+        """
+        Leaf reached in every tree by every row of X (a single row or a 2D batch)
+        Returns: intp array of shape (rows, trees) with indices into the node arrays
+        """
+        # Trees split float32 features, so compare the same values they were trained on
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        rows, n_features = X.shape
+        if n_features != self.n_features_in_:
+            # A wrong width would make the flat lookups read into the next row
+            raise ValueError(f"X has {n_features} features, but the forest was trained with {self.n_features_in_}")
+        values = X.ravel()
+        
+        row_offsets = (np.arange(rows) * n_features)[:, None]
+        nodes = np.repeat(self.roots[None, :], rows, axis=0)
+        for _ in range(self.depth):
+            go_right = values[row_offsets + self.features[nodes]] > self.thresholds[nodes]
+            nodes = self.children[2 * nodes + go_right]
+        return nodes
+    
+    def predict_proba(self, X):
+        """
+        Class probabilities averaged over the trees, like RandomForestClassifier.predict_proba
+        Returns: float64 array of shape (rows, classes)
+        """
+        # Summing over the tree axis adds the trees in order, as sklearn does
+        return self.leaf_values[self.apply(X)].sum(axis=1) / len(self.roots)
+    
+    def predict(self, X):
+        """
+        Returns: array of class labels, one per row
+        """
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+def compile_forest(forest):
+    """
+    Flatten the trees of a fitted RandomForestClassifier (single output) into one set of node arrays
+    Returns: CompiledForest
+    """
+    features, thresholds, children, leaf_values, roots = [], [], [], [], []
+    offset = 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        node_ids = np.arange(tree.node_count)
+        is_leaf = tree.children_left < 0
+        
+        # Leaves loop back to themselves; their feature only has to be a valid column
+        left = np.where(is_leaf, node_ids, tree.children_left) + offset
+        right = np.where(is_leaf, node_ids, tree.children_right) + offset
+        features.append(np.where(is_leaf, 0, tree.feature))
+        thresholds.append(tree.threshold)
+        children.append(np.stack([left, right], axis=1).ravel())
+        
+        # Per-tree class fractions, as DecisionTreeClassifier.predict_proba normalizes them
+        values = tree.value[:, 0, :]
+        leaf_values.append(values / np.maximum(values.sum(axis=1, keepdims=True), np.finfo(np.float64).tiny))
+        roots.append(offset)
+        offset += tree.node_count
+    
+    return CompiledForest(
+        features=np.concatenate(features).astype(np.intp),
+        thresholds=np.concatenate(thresholds).astype(np.float64),
+        children=np.concatenate(children).astype(np.intp),
+        leaf_values=np.concatenate(leaf_values),
+        roots=np.array(roots, dtype=np.intp),
+        depth=max(estimator.tree_.max_depth for estimator in forest.estimators_),
+        classes=forest.classes_,
+        n_features=forest.n_features_in_
+    )
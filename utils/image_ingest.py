@@ -0,0 +1,140 @@
+import cv2
+import numpy as np
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Background writer so persisting uploads never blocks a request
+_upload_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix='upload-writer')
+
+# Longest side an upload is decoded to, and longest side of the face crop that gets analyzed
+INGEST_MAX_SIDE = 1600
+FACE_MAX_SIDE = 1024
+
+# JPEG can be decoded straight at 1/2, 1/4 or 1/8 scale, which is much cheaper than a full decode
+_REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2)
+]
+
+def read_image_size(data):
+    """
+    Read (width, height) from a PNG, GIF or JPEG header without decoding the image
+    Returns: (width, height), or None for unknown formats
+    """
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+    
+    if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+        return int.from_bytes(data[6:8], 'little'), int.from_bytes(data[8:10], 'little')
+    
+    if data[:2] == b'\xff\xd8':
+        # Walk the JPEG segments until the start-of-frame marker
+        i = 2
+        while i + 9 < len(data):
+            if data[i] != 0xFF:
+                return None
+            marker = data[i + 1]
+            if marker == 0xFF:
+                i += 1
+                continue
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                return int.from_bytes(data[i + 7:i + 9], 'big'), int.from_bytes(data[i + 5:i + 7], 'big')
+            i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    
+    return None
+
+def ingest_image(data, max_side=INGEST_MAX_SIDE):
+    """
+    Decode an uploaded image straight from memory at bounded resolution
+    JPEGs are decoded at the largest reduced scale that keeps the longest side at least
+    max_side, then everything is area-resized down to max_side. EXIF orientation is applied.
+    Returns: (BGR numpy array or None, info dict with original and decoded dimensions)
+    """
+    info = {}
+    if not data:
+        return None, info
+    
+    size = read_image_size(data)
+    flags = cv2.IMREAD_COLOR
+    decode_scale = 1
+    if size and max_side:
+        for factor, reduced_flags in _REDUCED_DECODE_FLAGS:
+            if max(size) / factor >= max_side:
+                flags, decode_scale = reduced_flags, factor
+                break
+    
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    image = cv2.imdecode(buffer, flags)
+    if image is None:
+        return None, info
+    
+    height, width = image.shape[:2]
+    if size:
+        original_width, original_height = size
+        # EXIF rotation swaps the sides compared to the header
+        if (original_width > original_height) != (width > height):
+            original_width, original_height = original_height, original_width
+    else:
+        original_width, original_height = width * decode_scale, height * decode_scale
+    
+    if max_side and max(height, width) > max_side:
+        image = resize_to_max_side(image, max_side)
+    
+    info.update({
+        'original_width': original_width,
+        'original_height': original_height,
+        'decode_scale': decode_scale,
+        'width': image.shape[1],
+        'height': image.shape[0]
+    })
+    return image, info
+
+def resize_to_max_side(image, max_side):
+    """Area-downscale so the longest side is at most max_side (never upscales)"""
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return image
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+def normalize_face_crop(face_image, info=None, max_side=FACE_MAX_SIDE):
+    """
+    Bound the face crop size before analysis so per-request cost is predictable
+    The crop and analyzed sizes are recorded in info when given
+    """
+    normalized = resize_to_max_side(face_image, max_side) if max_side else face_image
+    if info is not None:
+        info.update({
+            'face_width': face_image.shape[1],
+            'face_height': face_image.shape[0],
+            'analysis_width': normalized.shape[1],
+            'analysis_height': normalized.shape[0]
+        })
+    return normalized
+
+def analysis_scale(info):
+    """
+    Linear factor between the analyzed face crop and the same face in the original photo:
+    the reduced JPEG decode and the ingest resize, times the face crop normalization
+    Returns: float, 1.0 when nothing was downscaled or the sizes are not known
+    """
+    scale = 1.0
+    if info.get('original_width') and info.get('width'):
+        scale *= max(info['width'], info['height']) / max(info['original_width'], info['original_height'])
+    if info.get('face_width') and info.get('analysis_width'):
+        scale *= max(info['analysis_width'], info['analysis_height']) / max(info['face_width'], info['face_height'])
+    return scale
+
+def _write_upload(data, filepath):
+    try:
+        os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+        with open(filepath, 'wb') as f:
+            f.write(data)
+    except Exception as e:
+        print(f"Error saving upload {filepath}: {e}")
+
+def persist_upload_async(data, filepath):
+    """Write the original upload bytes to disk in the background"""
+    return _upload_writer.submit(_write_upload, data, filepath)
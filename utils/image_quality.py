@@ -0,0 +1,87 @@
+import cv2
+import numpy as np
+
+# Quality checks run on a small grayscale proxy, so they cost next to nothing
+QUALITY_CHECK_SIDE = 256
+
+# Variance of the Laplacian on the proxy; below this the frame is too blurry to analyze
+MIN_FOCUS_MEASURE = 5.0
+# Mean brightness limits and how much of the frame may be crushed to black or clipped to white
+MIN_BRIGHTNESS = 40
+MAX_BRIGHTNESS = 235
+DARK_LEVEL = 25
+BRIGHT_LEVEL = 245
+MAX_DARK_FRACTION = 0.6
+MAX_CLIPPED_FRACTION = 0.4
+# The face crop has to cover at least this fraction of the frame
+MIN_FACE_FRACTION = 0.03
+
+QUALITY_MESSAGES = {
+    'blurry': 'The image is too blurry. Hold the camera steady and make sure your face is in focus.',
+    'too_dark': 'The image is too dark. Move to a brighter place or face a light source.',
+    'overexposed': 'The image is overexposed. Avoid direct light or flash on your face.',
+    'face_too_small': 'Your face is too small in the image. Move closer to the camera.'
+}
+
+def _gray_proxy(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    scale = QUALITY_CHECK_SIDE / max(gray.shape[:2])
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray
+
+def _rejection(reason, metrics):
+    return {
+        'passed': False,
+        'reason': reason,
+        'message': QUALITY_MESSAGES[reason],
+        'metrics': metrics
+    }
+
+def check_frame_quality(image):
+    """
+    Cheap focus and exposure check on the whole frame, run before face detection
+    Returns: dict with passed, reason (None when passed), message and the measured metrics
+    """
+    gray = _gray_proxy(image)
+    
+    # Focus measure: variance of the Laplacian
+    laplacian = cv2.Laplacian(gray, cv2.CV_32F)
+    _, std = cv2.meanStdDev(laplacian)
+    focus = float(std[0, 0]) ** 2
+    
+    # Brightness histogram
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    total = hist.sum()
+    brightness = float(np.dot(hist, np.arange(256)) / total)
+    dark_fraction = float(hist[:DARK_LEVEL + 1].sum() / total)
+    clipped_fraction = float(hist[BRIGHT_LEVEL:].sum() / total)
+    
+    metrics = {
+        'focus': round(focus, 2),
+        'brightness': round(brightness, 2),
+        'dark_fraction': round(dark_fraction, 4),
+        'clipped_fraction': round(clipped_fraction, 4)
+    }
+    
+    if brightness < MIN_BRIGHTNESS or dark_fraction > MAX_DARK_FRACTION:
+        return _rejection('too_dark', metrics)
+    if brightness > MAX_BRIGHTNESS or clipped_fraction > MAX_CLIPPED_FRACTION:
+        return _rejection('overexposed', metrics)
+    if focus < MIN_FOCUS_MEASURE:
+        return _rejection('blurry', metrics)
+    
+    return {'passed': True, 'reason': None, 'message': None, 'metrics': metrics}
+
+def check_face_quality(face_image, frame_shape):
+    """
+    Check that the detected face covers enough of the frame to be worth analyzing
+    Returns: dict with passed, reason (None when passed), message and the measured metrics
+    """
+    face_fraction = (face_image.shape[0] * face_image.shape[1]) / float(frame_shape[0] * frame_shape[1])
+    metrics = {'face_fraction': round(face_fraction, 4)}
+    
+    if face_fraction < MIN_FACE_FRACTION:
+        return _rejection('face_too_small', metrics)
+    
+    return {'passed': True, 'reason': None, 'message': None, 'metrics': metrics}
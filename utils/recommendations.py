@@ -222,5 +222,14 @@ def get_skincare_recommendations(skin_type, analysis):
             'Eat a balanced diet'
         ]
     
+    # Tone-specific advice on top of the general tips
+    skin_tone = analysis.get('skin_tone', {}).get('category')
+    if skin_tone in ('very light', 'light'):
+        recommendations['general_tips'].append('Use broad-spectrum SPF 30+ daily, lighter skin burns quickly')
+    elif skin_tone in ('brown', 'dark') and analysis.get('uneven_tone', {}).get('score', 0) > 20:
+        recommendations['general_tips'].append(
+            'Prefer gentle brightening (azelaic acid, niacinamide) over strong peels, which can leave dark marks'
+        )
+    
     return recommendations
 
@@ -0,0 +1,56 @@
+# Re-score every stored report after a change to the scoring or classification rules:
+#     python -m utils.report_rescoring [skincare.db]
+# Health scores and skin types are recomputed for all reports at once from the stored analyses.
+import json
+import sqlite3
+import sys
+import time
+
+from utils.skin_analysis import analysis_metrics, calculate_skin_health_scores, is_complete_analysis
+from utils.skin_classifier import classify_skin_types
+
+def rescore_reports(db_path='skincare.db'):
+    """
+    Recompute health_score and skin_type of every report from its analysis_data
+    Reports limited to some detectors are skipped, their missing metrics would be read as defaults
+    Returns: dict with the number of reports, how many changed, how many were skipped and the time taken
+    """
+    start = time.perf_counter()
+    conn = sqlite3.connect(db_path)
+    try:
+        c = conn.cursor()
+        c.execute('SELECT id, skin_type, health_score, analysis_data FROM reports')
+        rows = c.fetchall()
+        
+        # Analyses without results (no face) are scored like the app scores them
+        analyses = [json.loads(row[3]) if row[3] else {} for row in rows]
+        scored = [(row, analysis) for row, analysis in zip(rows, analyses) if not analysis or is_complete_analysis(analysis)]
+        rows = [row for row, _ in scored]
+        metrics = analysis_metrics([analysis for _, analysis in scored])
+        health_scores = calculate_skin_health_scores(metrics)
+        skin_types = classify_skin_types(metrics)
+        
+        changed = [
+            (str(skin_type), float(health_score), row[0])
+            for row, skin_type, health_score in zip(rows, skin_types, health_scores)
+            if (row[1], row[2]) != (skin_type, health_score)
+        ]
+        c.executemany('UPDATE reports SET skin_type = ?, health_score = ? WHERE id = ?', changed)
+        conn.commit()
+    finally:
+        conn.close()
+    
+    return {
+        'reports': len(analyses),
+        'changed': len(changed),
+        'skipped': len(analyses) - len(rows),
+        'time_ms': round((time.perf_counter() - start) * 1000, 2)
+    }
+
+def main(args):
+    report = rescore_reports(*args[:1])
+    print(f"{report['reports']} reports, {report['changed']} changed, {report['skipped']} partial skipped, {report['time_ms']} ms")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,132 @@
+# Calibration harness for the reduced working resolution of analyze_skin:
+#     python -m utils.resolution_calibration photo1.jpg photo2.jpg ...
+# reports, for every candidate working side, the speedup over full-resolution analysis,
+# how far each metric drifts and how often its level label changes.
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from utils.image_ingest import resize_to_max_side
+from utils.skin_analysis import SkinFeatures, analyze_skin
+
+CALIBRATION_SIDES = (768, 512, 384, 256)
+
+# The value and the label reported by each detector
+CALIBRATED_METRICS = {
+    'acne_spots': ('severity', 'level'),
+    'dark_circles': ('severity', 'level'),
+    'redness': ('severity', 'level'),
+    'oiliness': ('score', 'level'),
+    'dryness': ('score', 'level'),
+    'uneven_tone': ('score', 'level'),
+    'texture': ('score', 'smoothness')
+}
+
+def _timed_analyses(face_images, working_side, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        analyses = [analyze_skin(None, face_image, working_side) for face_image in face_images]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return analyses, best * 1000 / len(face_images)
+
+def calibrate_working_resolution(face_images, working_sides=CALIBRATION_SIDES, repeat=3):
+    """
+    Compare analysis at each working side with full-resolution analysis of the same crops
+    Returns: dict with the full-resolution time per image and one row per working side
+             (time, speedup, mean/max metric drift and label agreement per metric)
+    """
+    reference, full_ms = _timed_analyses(face_images, None, repeat)
+    
+    rows = []
+    for working_side in working_sides:
+        analyses, ms = _timed_analyses(face_images, working_side, repeat)
+        
+        metrics = {}
+        for name, (value_key, label_key) in CALIBRATED_METRICS.items():
+            drift = np.array([abs(a[name][value_key] - r[name][value_key]) for a, r in zip(analyses, reference)])
+            agreement = np.mean([a[name][label_key] == r[name][label_key] for a, r in zip(analyses, reference)])
+            metrics[name] = {
+                'mean_drift': round(float(drift.mean()), 2),
+                'max_drift': round(float(drift.max()), 2),
+                'label_agreement': round(float(agreement), 4)
+            }
+        
+        rows.append({
+            'working_side': working_side,
+            'time_ms': round(ms, 2),
+            'speedup': round(full_ms / ms, 2),
+            'labels_stable': all(m['label_agreement'] == 1 for m in metrics.values()),
+            'metrics': metrics
+        })
+    
+    return {'images': len(face_images), 'full_time_ms': round(full_ms, 2), 'sides': rows}
+
+def _raw_measures(face_image):
+    features = SkinFeatures(face_image)
+    return {
+        'oiliness': cv2.meanStdDev(features.gray)[1][0, 0] ** 2,
+        'dryness': cv2.meanStdDev(features.laplacian)[1][0, 0] ** 2,
+        'uneven_tone': cv2.meanStdDev(features.lab)[1][1:, 0].mean(),
+        'texture': cv2.mean(features.gradient_magnitude)[0]
+    }
+
+def fit_resolution_exponents(face_images, working_sides=CALIBRATION_SIDES):
+    """
+    Least-squares fit of measure(resized) = measure(original) * s ** exponent over the sample set
+    Returns: dict of fitted exponents, to compare with RESOLUTION_EXPONENTS
+    """
+    log_scales = []
+    log_ratios = {name: [] for name in ('oiliness', 'dryness', 'uneven_tone', 'texture')}
+    for face_image in face_images:
+        full = _raw_measures(face_image)
+        for working_side in working_sides:
+            resized = resize_to_max_side(face_image, working_side)
+            if resized is face_image:
+                continue
+            measures = _raw_measures(resized)
+            log_scales.append(np.log(resized.shape[0] / face_image.shape[0]))
+            for name in log_ratios:
+                log_ratios[name].append(np.log(max(measures[name], 1e-9) / max(full[name], 1e-9)))
+    
+    if not log_scales:
+        return {}
+    
+    log_scales = np.array(log_scales)
+    return {
+        name: round(float(np.dot(log_scales, ratios) / np.dot(log_scales, log_scales)), 2)
+        for name, ratios in log_ratios.items()
+    }
+
+def main(paths):
+    from utils.face_detection import detect_face
+    
+    face_images = []
+    for path in paths:
+        face_detected, face_image = detect_face(path)
+        if face_detected:
+            face_images.append(face_image)
+        else:
+            print(f"{path}: no face detected, skipped")
+    
+    if not face_images:
+        print("No usable sample images")
+        return 1
+    
+    report = calibrate_working_resolution(face_images)
+    print(f"{report['images']} images, full resolution {report['full_time_ms']} ms/image")
+    for row in report['sides']:
+        worst = min(row['metrics'].items(), key=lambda item: item[1]['label_agreement'])
+        print(
+            f"side {row['working_side']:>5}: {row['time_ms']:>8} ms/image  x{row['speedup']:<6}"
+            f" labels stable: {row['labels_stable']}  worst: {worst[0]} ({worst[1]['label_agreement']:.0%},"
+            f" max drift {worst[1]['max_drift']})"
+        )
+    print(f"fitted exponents: {fit_resolution_exponents(face_images)}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
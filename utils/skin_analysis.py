@@ -1,58 +1,325 @@
+import base64
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
 import cv2
 import numpy as np
 from sklearn.cluster import KMeans
 
-def analyze_skin(image_path, face_image):
+from utils.buffer_arena import arena_pool
+from utils.color_tables import RED_HSV_RANGES, color_histogram, color_statistics
+from utils.image_ingest import resize_to_max_side
+
+class SkinFeatures:
+    """
+    Derived image planes for one face crop (gray, blurred gray, gradients, LAB, color histogram,
+    skin mask).
+    Each plane is computed lazily, at most once, and shared by every detector of the analysis.
+    scale is the linear factor between the analyzed image and the original photo.
+    With an arena, planes and masks are written into its reusable buffers.
+    Planes that were already computed elsewhere can be passed in as planes.
+    """
+    def __init__(self, image, scale=1.0, arena=None, planes=None):
+        self.image = image
+        self.scale = scale
+        self.arena = arena
+        self._planes = dict(planes) if planes else {}
+    
+    def buffer(self, name, channels=1, dtype=np.uint8):
+        """Output buffer of the crop's size for dst=, or None to let OpenCV allocate"""
+        if self.arena is None:
+            return None
+        shape = self.image.shape[:2] if channels == 1 else self.image.shape[:2] + (channels,)
+        return self.arena.get(name, shape, dtype)
+    
+    def plane(self, name):
+        if name not in self._planes:
+            self._planes[name] = PLANE_BUILDERS[name](self)
+        return self._planes[name]
+    
+    def computed_planes(self):
+        return set(self._planes)
+    
+    def precompute(self, names, parallel=False):
+        """
+        Compute the named planes and the planes they depend on up front, so detectors only read them.
+        With parallel, independent planes are built at the same time on the analysis pool.
+        """
+        for level in plane_levels(names):
+            missing = [name for name in level if name not in self._planes]
+            if parallel and len(missing) > 1:
+                built = run_on_analysis_pool([partial(PLANE_BUILDERS[name], self) for name in missing])
+            else:
+                built = [PLANE_BUILDERS[name](self) for name in missing]
+            self._planes.update(zip(missing, built))
+    
+    @property
+    def gray(self):
+        return self.plane('gray')
+    
+    @property
+    def blurred_gray(self):
+        return self.plane('blurred_gray')
+    
+    @property
+    def color_histogram(self):
+        return self.plane('color_histogram')
+    
+    @property
+    def skin_mask(self):
+        """uint8 mask of the skin pixels (255), or None to analyze the whole crop"""
+        return self.plane('skin_mask')
+    
+    def skin_pixels(self):
+        """Number of pixels the masked statistics cover"""
+        mask = self.skin_mask
+        return cv2.countNonZero(mask) if mask is not None else self.image.shape[0] * self.image.shape[1]
+    
+    @property
+    def lab(self):
+        return self.plane('lab')
+    
+    @property
+    def laplacian(self):
+        return self.plane('laplacian')
+    
+    @property
+    def gradient_magnitude(self):
+        return self.plane('gradient_magnitude')
+    
+    def to_full_resolution(self, measure, value):
+        """Convert a resolution-dependent measure to its value on the original crop"""
+        if self.scale == 1:
+            return value
+        return value / self.scale ** RESOLUTION_EXPONENTS[measure]
+
+# Derivatives of an 8-bit image are small integers, so float32 holds them exactly
+PLANE_BUILDERS = {
+    'gray': lambda f: cv2.cvtColor(f.image, cv2.COLOR_BGR2GRAY, dst=f.buffer('gray')),
+    'blurred_gray': lambda f: cv2.GaussianBlur(f.gray, (5, 5), 0, dst=f.buffer('blurred_gray')),
+    'skin_mask': lambda f: skin_mask(f.image, f.buffer('ycrcb', 3), f.buffer('skin_mask')),
+    'color_histogram': lambda f: color_histogram(f.image, f.skin_mask),
+    'lab': lambda f: cv2.cvtColor(f.image, cv2.COLOR_BGR2LAB, dst=f.buffer('lab', 3)),
+    'laplacian': lambda f: cv2.Laplacian(f.gray, cv2.CV_32F, dst=f.buffer('laplacian', dtype=np.float32)),
+    'sobel_x': lambda f: cv2.Sobel(f.gray, cv2.CV_32F, 1, 0, dst=f.buffer('sobel_x', dtype=np.float32), ksize=3),
+    'sobel_y': lambda f: cv2.Sobel(f.gray, cv2.CV_32F, 0, 1, dst=f.buffer('sobel_y', dtype=np.float32), ksize=3),
+    'gradient_magnitude': lambda f: cv2.magnitude(
+        f.plane('sobel_x'), f.plane('sobel_y'), f.buffer('gradient_magnitude', dtype=np.float32)
+    )
+}
+
+# Planes each builder reads
+PLANE_DEPENDENCIES = {
+    'gray': (),
+    'blurred_gray': ('gray',),
+    'skin_mask': (),
+    'color_histogram': ('skin_mask',),
+    'lab': (),
+    'laplacian': ('gray',),
+    'sobel_x': ('gray',),
+    'sobel_y': ('gray',),
+    'gradient_magnitude': ('sobel_x', 'sobel_y')
+}
+
+# Skin color range in YCrCb (the Cr/Cb bounds commonly used for skin detection)
+SKIN_YCRCB_RANGE = (np.array([0, 133, 77]), np.array([255, 173, 127]))
+# Opening removes isolated skin-colored specks, closing fills pores and small highlights
+SKIN_MASK_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+# With less skin than this share of the crop (unusual lighting or skin tone outside the
+# range) the mask is not trusted and the whole crop is analyzed
+SKIN_MASK_MIN_FRACTION = 0.2
+
+def skin_mask(image, ycrcb=None, dst=None):
+    """
+    Skin pixels of a face crop: YCrCb thresholds followed by a morphological open and close
+    Returns: uint8 mask (255 = skin), or None when too little of the crop looks like skin
+    """
+    ycrcb = cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb, dst=ycrcb)
+    return refine_skin_mask(cv2.inRange(ycrcb, *SKIN_YCRCB_RANGE, dst=dst))
+
+def refine_skin_mask(mask):
+    """
+    Morphological open and close of a YCrCb range mask, in place, to drop specks and fill small holes
+    Returns: the mask, or None when too little of the crop looks like skin
+    """
+    cv2.morphologyEx(mask, cv2.MORPH_OPEN, SKIN_MASK_KERNEL, dst=mask)
+    cv2.morphologyEx(mask, cv2.MORPH_CLOSE, SKIN_MASK_KERNEL, dst=mask)
+    
+    if cv2.countNonZero(mask) < SKIN_MASK_MIN_FRACTION * mask.size:
+        return None
+    return mask
+
+def plane_levels(names):
+    """
+    The named planes and their dependencies, grouped so that every plane only
+    depends on planes of earlier groups
+    Returns: list of lists of plane names
+    """
+    depth = {}
+    
+    def visit(name):
+        if name not in depth:
+            depth[name] = 1 + max((visit(dependency) for dependency in PLANE_DEPENDENCIES[name]), default=-1)
+        return depth[name]
+    
+    for name in names:
+        visit(name)
+    levels = max(depth.values(), default=-1) + 1
+    return [sorted(name for name in depth if depth[name] == level) for level in range(levels)]
+
+# Shared, bounded pool for parallel analysis. OpenCV releases the GIL in its kernels,
+# so detectors of one request can run on several cores at once.
+ANALYSIS_WORKERS = min(4, os.cpu_count() or 1)
+_analysis_pool = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix='skin-analysis')
+_pool_in_flight = 0
+_pool_lock = threading.Lock()
+
+@contextmanager
+def _reserve_pool(tasks):
+    """Reserve pool capacity for tasks, yields False when every worker is already busy"""
+    global _pool_in_flight
+    with _pool_lock:
+        available = _pool_in_flight < ANALYSIS_WORKERS
+        if available:
+            _pool_in_flight += tasks
+    try:
+        yield available
+    finally:
+        if available:
+            with _pool_lock:
+                _pool_in_flight -= tasks
+
+def run_on_analysis_pool(tasks):
+    """
+    Run callables on the shared analysis pool, or one after another in the
+    calling thread when the pool is saturated by other requests
+    Returns: their results, in order
+    """
+    with _reserve_pool(len(tasks)) as available:
+        if not available:
+            return [task() for task in tasks]
+        futures = [_analysis_pool.submit(task) for task in tasks]
+        return [future.result() for future in futures]
+
+# How the resolution-dependent measures change when a crop is resized by a linear factor s:
+# measure(resized) ~ measure(original) * s ** exponent. Contour areas follow s ** 2 exactly,
+# the derivative-based exponents were fitted with utils/resolution_calibration.py.
+RESOLUTION_EXPONENTS = {
+    'acne_area': 2.0,
+    'oiliness': 0.0,
+    'dryness': 1.7,
+    'uneven_tone': 0.25,
+    'texture': 0.3
+}
+
+def analyze_skin(
+    image_path, face_image, working_side=None, stats=None, zones=True, detectors=None, parallel=False, heatmaps=False,
+    scale=1.0
+):
     """
     Analyze skin conditions: acne, dark circles, oiliness, dryness, redness
+    scale is the linear factor face_image was already downscaled by from the original
+    photo (see image_ingest.analysis_scale); the resolution-dependent thresholds are
+    rescaled by it so that results refer to the original resolution.
+    With working_side, larger crops are analyzed at that longest side and the
+    rescaling covers that downscale too.
+    With zones, per-zone results (T-zone, cheeks, under-eye) are added under 'zones'.
+    detectors limits the analysis to the named detectors of the registry.
+    With parallel, planes and detectors run on the shared analysis pool (same results).
+    With heatmaps, a quantized grid of local severity per detector is added under 'heatmaps'.
+    Peak intermediate memory and per-detector wall time are recorded in stats when given.
     Returns: Dictionary with analysis results
     """
     if face_image is None:
         return {}
     
-    # Convert to different color spaces for analysis
-    hsv = cv2.cvtColor(face_image, cv2.COLOR_BGR2HSV)
-    lab = cv2.cvtColor(face_image, cv2.COLOR_BGR2LAB)
-    
-    # Analyze different skin conditions
-    analysis = {
-        'acne_spots': detect_acne(face_image, hsv),
-        'dark_circles': detect_dark_circles(face_image, lab),
-        'redness': detect_redness(face_image, hsv),
-        'oiliness': detect_oiliness(face_image),
-        'dryness': detect_dryness(face_image),
-        'uneven_tone': detect_uneven_tone(face_image, lab),
-        'texture': analyze_texture(face_image)
-    }
+    if working_side and max(face_image.shape[:2]) > working_side:
+        height = face_image.shape[0]
+        face_image = resize_to_max_side(face_image, working_side)
+        scale *= face_image.shape[0] / height
+    
+    # Shared planes, computed on first use into buffers reused across requests
+    with arena_pool.checkout() as arena:
+        timings = {} if stats is not None else None
+        analysis = analyze_features(SkinFeatures(face_image, scale, arena), zones, detectors, timings, parallel, heatmaps)
+        
+        if stats is not None:
+            stats['memory'] = arena.request_stats()
+            stats['timings_ms'] = timings
     
     return analysis
 
-def detect_acne(image, hsv):
-    """Detect acne spots using color and texture analysis"""
-    # Convert to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    
-    # Apply Gaussian blur
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    
-    # Detect dark spots (potential acne)
-    _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+def select_detectors(detectors=None, zones=True):
+    """
+    Registry entries for the requested detector names (all of them by default)
+    Returns: list of SkinDetector
+    """
+    if detectors is None:
+        return [detector for name, detector in skin_detectors.items() if zones or name != 'zones']
     
-    # Find contours
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    unknown = [name for name in detectors if name not in skin_detectors]
+    if unknown:
+        raise ValueError(f"Unknown skin detectors: {', '.join(unknown)}")
+    return [skin_detectors[name] for name in detectors]
+
+def analyze_features(features, zones=True, detectors=None, timings=None, parallel=False, heatmaps=False):
+    """
+    Run the selected detectors on the shared planes of one crop
+    With heatmaps, the detectors that have one also map their severity over a HEATMAP_GRID
+    Wall time per detector in ms is recorded in timings when given
+    Returns: Dictionary with analysis results
+    """
+    selected = select_detectors(detectors, zones)
+    if parallel:
+        # Detectors on other threads must only read planes, so build the declared inputs first
+        features.precompute({name for detector in selected for name in detector.inputs}, parallel=True)
+        results = run_on_analysis_pool([partial(detector.run, features) for detector in selected])
+    else:
+        results = [detector.run(features) for detector in selected]
+    
+    analysis = {}
+    for detector, (result, elapsed_ms) in zip(selected, results):
+        analysis[detector.name] = result
+        if timings is not None:
+            timings[detector.name] = round(elapsed_ms, 3)
+    
+    if heatmaps:
+        start = time.perf_counter()
+        analysis['heatmaps'] = {
+            detector.name: encode_heatmap(detector.heatmap(features, HEATMAP_GRID))
+            for detector in selected if detector.heatmap is not None
+        }
+        if timings is not None:
+            timings['heatmaps'] = round((time.perf_counter() - start) * 1000, 3)
     
-    # Filter small dark spots
+    return analysis
+
+# Dark spots within this contour area range (pixels) count as acne
+ACNE_MIN_AREA = 10
+ACNE_MAX_AREA = 500
+
+def count_acne_spots(contours, min_area=ACNE_MIN_AREA, max_area=ACNE_MAX_AREA):
+    """Count dark-spot contours in the acne size range and sum their area"""
     acne_count = 0
     total_area = 0
     
     for contour in contours:
+        # Specks of one or two points enclose no area; noisy masks have many of them
+        if len(contour) < 3:
+            continue
         area = cv2.contourArea(contour)
-        if 10 < area < 500:  # Filter by size
+        if min_area < area < max_area:  # Filter by size
             acne_count += 1
             total_area += area
     
+    return acne_count, total_area
+
+def acne_result(acne_count, total_area, image_area):
     # Calculate acne severity (0-100)
-    image_area = image.shape[0] * image.shape[1]
     severity = min(100, (total_area / image_area) * 1000)
     
     return {
@@ -61,23 +328,7 @@ def detect_acne(image, hsv):
         'level': 'low' if severity < 10 else 'medium' if severity < 30 else 'high'
     }
 
-def detect_dark_circles(image, lab):
-    """Detect dark circles around eyes using LAB color space"""
-    # Extract L channel (lightness)
-    l_channel = lab[:, :, 0]
-    
-    # Focus on lower half of face (eye region approximation)
-    height = image.shape[0]
-    eye_region = l_channel[:height//2, :]
-    
-    # Calculate average lightness in eye region
-    avg_lightness = np.mean(eye_region)
-    
-    # Detect dark regions
-    dark_threshold = avg_lightness * 0.7
-    dark_pixels = np.sum(eye_region < dark_threshold)
-    total_pixels = eye_region.size
-    
+def dark_circles_result(dark_pixels, total_pixels):
     darkness_percentage = (dark_pixels / total_pixels) * 100
     
     return {
@@ -85,37 +336,16 @@ def detect_dark_circles(image, lab):
         'level': 'low' if darkness_percentage < 15 else 'medium' if darkness_percentage < 30 else 'high'
     }
 
-def detect_redness(image, hsv):
-    """Detect redness in skin using HSV color space"""
-    # Red color range in HSV
-    lower_red1 = np.array([0, 50, 50])
-    upper_red1 = np.array([10, 255, 255])
-    lower_red2 = np.array([170, 50, 50])
-    upper_red2 = np.array([180, 255, 255])
-    
-    # Create masks for red regions
-    mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
-    mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-    red_mask = mask1 + mask2
-    
-    # Calculate redness percentage
-    red_pixels = np.sum(red_mask > 0)
-    total_pixels = image.shape[0] * image.shape[1]
-    redness_percentage = (red_pixels / total_pixels) * 100
+def redness_result(red_pixels, total_pixels):
+    # Calculate redness percentage (as a numpy float, so it rounds exactly like stored reports)
+    redness_percentage = (np.float64(red_pixels) / total_pixels) * 100
     
     return {
         'severity': round(redness_percentage, 2),
         'level': 'low' if redness_percentage < 10 else 'medium' if redness_percentage < 25 else 'high'
     }
 
-def detect_oiliness(image):
-    """Detect oily skin by analyzing skin shine/reflection"""
-    # Convert to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    
-    # Calculate variance in pixel intensities (oily skin has more variation due to shine)
-    variance = np.var(gray)
-    
+def oiliness_result(variance):
     # Normalize variance (0-100 scale)
     # This is a simplified approach - in production, use ML model
     oiliness_score = min(100, (variance / 1000) * 100)
@@ -125,15 +355,7 @@ def detect_oiliness(image):
         'level': 'low' if oiliness_score < 30 else 'medium' if oiliness_score < 60 else 'high'
     }
 
-def detect_dryness(image):
-    """Detect dry skin by analyzing texture and flakiness"""
-    # Convert to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    
-    # Apply Laplacian to detect edges (dry skin has more visible texture)
-    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-    variance = np.var(laplacian)
-    
+def dryness_result(variance):
     # Higher variance indicates more texture (potential dryness)
     dryness_score = min(100, (variance / 500) * 100)
     
@@ -142,16 +364,7 @@ def detect_dryness(image):
         'level': 'low' if dryness_score < 20 else 'medium' if dryness_score < 50 else 'high'
     }
 
-def detect_uneven_tone(image, lab):
-    """Detect uneven skin tone using LAB color space"""
-    # Extract A and B channels (color information)
-    a_channel = lab[:, :, 1]
-    b_channel = lab[:, :, 2]
-    
-    # Calculate standard deviation (higher = more uneven)
-    a_std = np.std(a_channel)
-    b_std = np.std(b_channel)
-    
+def uneven_tone_result(a_std, b_std):
     # Combine both channels
     unevenness_score = ((a_std + b_std) / 2) * 2
     
@@ -160,23 +373,475 @@ def detect_uneven_tone(image, lab):
         'level': 'low' if unevenness_score < 15 else 'medium' if unevenness_score < 30 else 'high'
     }
 
-def analyze_texture(image):
-    """Analyze skin texture using Local Binary Patterns (simplified)"""
-    # Convert to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+def texture_result(texture_score):
+    # Round as a numpy float, like the other scores and stored reports
+    texture_score = np.float64(texture_score)
+    
+    return {
+        'score': round(texture_score, 2),
+        'smoothness': 'smooth' if texture_score < 20 else 'moderate' if texture_score < 40 else 'rough'
+    }
+
+def dark_spot_mask(blurred_gray, skin=None, dst=None):
+    """
+    Pixels darker than the Otsu threshold of the skin pixels (of the whole plane without a skin mask)
+    Returns: uint8 mask (255 = dark spot)
+    """
+    if skin is None:
+        _, thresh = cv2.threshold(blurred_gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU, dst=dst)
+        return thresh
+    
+    # Threshold from the skin pixels alone, so hair, eyes and background do not shift it
+    otsu, _ = cv2.threshold(blurred_gray[skin > 0].reshape(-1, 1), 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, thresh = cv2.threshold(blurred_gray, otsu, 255, cv2.THRESH_BINARY_INV, dst=dst)
+    return cv2.bitwise_and(thresh, skin, dst=thresh)
+
+def acne_spot_contours(features):
+    """Contours of the dark spots on the skin and the acne size range at the analyzed resolution"""
+    # Detect dark spots (potential acne) on the blurred grayscale plane
+    thresh = dark_spot_mask(features.blurred_gray, features.skin_mask, features.buffer('acne_mask'))
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    
+    # The size range is given at full resolution
+    area_scale = features.scale ** RESOLUTION_EXPONENTS['acne_area']
+    return contours, ACNE_MIN_AREA * area_scale, ACNE_MAX_AREA * area_scale
+
+def detect_acne(features):
+    """Detect acne spots using color and texture analysis"""
+    # Find contours and filter small dark spots
+    contours, min_area, max_area = acne_spot_contours(features)
+    acne_count, total_area = count_acne_spots(contours, min_area, max_area)
+    
+    # Relative to the skin area
+    return acne_result(acne_count, total_area, features.skin_pixels())
+
+def count_dark_pixels(lightness, skin=None, out=None):
+    """
+    Pixels darker than 0.7 times the average lightness, among the skin pixels when a mask is given
+    Returns: (dark pixels, pixels considered)
+    """
+    skin_pixels = cv2.countNonZero(skin) if skin is not None else 0
+    if not skin_pixels:
+        # Calculate average lightness and detect dark regions
+        dark_threshold = np.mean(lightness) * 0.7
+        return np.sum(np.less(lightness, dark_threshold, out=out)), lightness.size
+    
+    dark_threshold = cv2.mean(lightness, mask=skin)[0] * 0.7
+    dark = np.less(lightness, dark_threshold, out=out)
+    return np.count_nonzero(np.logical_and(dark, skin, out=dark)), skin_pixels
+
+def detect_dark_circles(features):
+    """Detect dark circles around eyes using LAB color space"""
+    # Extract L channel (lightness)
+    l_channel = features.lab[:, :, 0]
+    
+    # Focus on upper half of face (eye region approximation)
+    height = features.image.shape[0]
+    eye_region = l_channel[:height//2, :]
+    eye_skin = features.skin_mask[:height//2] if features.skin_mask is not None else None
     
+    dark_mask = features.arena.get('dark_mask', eye_region.shape, bool) if features.arena else None
+    dark_pixels, total_pixels = count_dark_pixels(eye_region, eye_skin, dark_mask)
+    
+    return dark_circles_result(dark_pixels, total_pixels)
+
+def detect_redness(features):
+    """Detect redness in skin using the red hue range of HSV color space"""
+    # Expected number of red-hue pixels, looked up per color bin instead of converting to HSV
+    colors = color_statistics(features.color_histogram)
+    return redness_result(colors['red_pixels'], colors['pixels'])
+
+def detect_oiliness(features):
+    """Detect oily skin by analyzing skin shine/reflection"""
+    # Calculate variance in pixel intensities (oily skin has more variation due to shine)
+    _, std = cv2.meanStdDev(features.gray, mask=features.skin_mask)
+    
+    return oiliness_result(features.to_full_resolution('oiliness', std[0, 0] ** 2))
+
+def detect_dryness(features):
+    """Detect dry skin by analyzing texture and flakiness"""
+    # Laplacian detects edges (dry skin has more visible texture)
+    _, std = cv2.meanStdDev(features.laplacian, mask=features.skin_mask)
+    
+    return dryness_result(features.to_full_resolution('dryness', std[0, 0] ** 2))
+
+def detect_uneven_tone(features):
+    """Detect uneven skin tone using LAB color space"""
+    # Standard deviation of the A and B channels, which carry the color information
+    # (higher = more uneven), from the same color histogram as redness
+    colors = color_statistics(features.color_histogram)
+    a_std = features.to_full_resolution('uneven_tone', colors['a_std'])
+    b_std = features.to_full_resolution('uneven_tone', colors['b_std'])
+    return uneven_tone_result(a_std, b_std)
+
+def analyze_texture(features):
+    """Analyze skin texture using Local Binary Patterns (simplified)"""
     # Calculate texture using gradient magnitude
-    sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-    sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-    gradient_magnitude = np.sqrt(sobelx**2 + sobely**2)
+    texture_score = cv2.mean(features.gradient_magnitude, mask=features.skin_mask)[0]
+    return texture_result(features.to_full_resolution('texture', texture_score))
+
+# Skin tone is clustered from a fixed number of sampled pixels, so its cost does not depend on the crop size
+SKIN_TONE_SAMPLE_PIXELS = 2048
+SKIN_TONE_CLUSTERS = 3
+# 8-bit LAB lightness of skin; eyes, brows, hair and specular highlights mostly fall outside
+SKIN_LIGHTNESS_RANGE = (50, 240)
+# Lower bounds of the individual typology angle (degrees) per skin tone category, darker below
+ITA_CATEGORIES = [(55, 'very light'), (41, 'light'), (28, 'intermediate'), (10, 'tan'), (-30, 'brown')]
+
+def sample_skin_pixels(lab, mask=None, budget=SKIN_TONE_SAMPLE_PIXELS):
+    """
+    Random sample of the skin-colored pixels of a LAB plane (the same positions for the same crop size)
+    Returns: float32 array of shape (n, 3) with n <= budget
+    """
+    rng = np.random.default_rng(0)
+    height, width = lab.shape[:2]
+    rows, cols = rng.integers(0, height, budget), rng.integers(0, width, budget)
+    samples = lab[rows, cols]
+    
+    lightness = samples[:, 0]
+    is_skin = (lightness >= SKIN_LIGHTNESS_RANGE[0]) & (lightness <= SKIN_LIGHTNESS_RANGE[1])
+    if mask is not None:
+        is_skin &= mask[rows, cols] > 0
+    skin = samples[is_skin]
+    # Hardly anything looks like skin (e.g. a very dark photo): use every sample
+    if len(skin) < SKIN_TONE_CLUSTERS * 10:
+        skin = samples
+    return skin.astype(np.float32)
+
+def skin_tone_result(lab_color, coverage):
+    # 8-bit OpenCV LAB to CIELAB
+    lightness = lab_color[0] * 100 / 255
+    a, b = lab_color[1] - 128, lab_color[2] - 128
     
-    texture_score = np.mean(gradient_magnitude)
+    # Individual typology angle: higher is lighter
+    ita = float(np.degrees(np.arctan2(lightness - 50, b)))
+    category = next((name for bound, name in ITA_CATEGORIES if ita > bound), 'dark')
+    
+    # Hue angle of the chroma: more yellow is warmer, more red/pink is cooler (simplified)
+    hue = float(np.degrees(np.arctan2(b, a)))
+    undertone = 'warm' if hue >= 60 else 'cool' if hue < 45 else 'neutral'
     
     return {
-        'score': round(texture_score, 2),
-        'smoothness': 'smooth' if texture_score < 20 else 'moderate' if texture_score < 40 else 'rough'
+        'category': category,
+        'ita': round(ita, 2),
+        'undertone': undertone if np.hypot(a, b) >= 5 else 'neutral',
+        'lab': [round(float(lightness), 1), round(float(a), 1), round(float(b), 1)],
+        'coverage': round(float(coverage), 2)
+    }
+
+def detect_skin_tone(features):
+    """Estimate the dominant skin tone by clustering sampled skin pixels in LAB color space"""
+    samples = sample_skin_pixels(features.lab, features.skin_mask)
+    # Distinct colors of the 8-bit LAB samples, each packed into one integer: much cheaper than np.unique over rows
+    colors = samples.astype(np.int64) @ np.array([1 << 16, 1 << 8, 1])
+    clusters = min(SKIN_TONE_CLUSTERS, len(np.unique(colors)))
+    
+    # With a fixed sample, full-batch k-means is cheaper than mini-batches
+    kmeans = KMeans(n_clusters=clusters, n_init=1, random_state=0).fit(samples)
+    counts = np.bincount(kmeans.labels_, minlength=clusters)
+    dominant = counts.argmax()
+    
+    # coverage: share of the sampled skin in the dominant cluster
+    return skin_tone_result(kmeans.cluster_centers_[dominant], counts[dominant] / len(samples))
+
+# Facial zones as (top, bottom, left, right) fractions of a detected face crop.
+# A zone can be made of several rectangles, e.g. the T-zone is the forehead plus the nose.
+FACIAL_ZONES = {
+    't_zone': [(0.08, 0.28, 0.30, 0.70), (0.28, 0.65, 0.42, 0.58)],
+    'cheeks': [(0.50, 0.75, 0.15, 0.38), (0.50, 0.75, 0.62, 0.85)],
+    'under_eye': [(0.40, 0.50, 0.20, 0.42), (0.40, 0.50, 0.58, 0.80)]
+}
+
+def zone_views(plane, rects):
+    """Views of a plane for the rectangles of a zone (no pixels are copied)"""
+    height, width = plane.shape[:2]
+    return [
+        plane[int(top * height):int(bottom * height), int(left * width):int(right * width)]
+        for top, bottom, left, right in rects
+    ]
+
+def zone_skin(features, rects):
+    """Skin mask views of a zone, or Nones (whole rectangles) without a mask or without skin in the zone"""
+    if features.skin_mask is not None:
+        masks = zone_views(features.skin_mask, rects)
+        if any(cv2.countNonZero(mask) for mask in masks):
+            return masks
+    return [None] * len(rects)
+
+def pooled_variance(views, masks=None):
+    """Variance over all (masked) pixels of several single-channel views taken together"""
+    masks = masks or [None] * len(views)
+    counts = np.array([
+        view.shape[0] * view.shape[1] if mask is None else cv2.countNonZero(mask) for view, mask in zip(views, masks)
+    ], float)
+    moments = np.array([[m[0, 0], s[0, 0]] for m, s in (cv2.meanStdDev(view, mask=mask) for view, mask in zip(views, masks))])
+    mean = np.dot(counts, moments[:, 0]) / counts.sum()
+    return np.dot(counts, moments[:, 1] ** 2 + moments[:, 0] ** 2) / counts.sum() - mean ** 2
+
+def zone_oiliness(features, rects):
+    variance = pooled_variance(zone_views(features.gray, rects), zone_skin(features, rects))
+    return oiliness_result(features.to_full_resolution('oiliness', variance))
+
+def zone_dryness(features, rects):
+    variance = pooled_variance(zone_views(features.laplacian, rects), zone_skin(features, rects))
+    return dryness_result(features.to_full_resolution('dryness', variance))
+
+def zone_redness(features, rects):
+    colors = color_statistics([
+        color_histogram(view, mask) for view, mask in zip(zone_views(features.image, rects), zone_skin(features, rects))
+    ])
+    return redness_result(colors['red_pixels'], colors['pixels'])
+
+def zone_dark_circles(features, rects):
+    # Dark pixels relative to the average lightness of the zone itself
+    views = zone_views(features.lab[:, :, 0], rects)
+    masks = zone_skin(features, rects)
+    if masks[0] is None:
+        total_pixels = sum(view.size for view in views)
+        dark_threshold = sum(np.sum(view, dtype=np.int64) for view in views) / total_pixels * 0.7
+        dark_pixels = sum(np.count_nonzero(view < dark_threshold) for view in views)
+        return dark_circles_result(dark_pixels, total_pixels)
+    
+    counts = [cv2.countNonZero(mask) for mask in masks]
+    total_pixels = sum(counts)
+    dark_threshold = sum(cv2.mean(view, mask=mask)[0] * count for view, mask, count in zip(views, masks, counts))
+    dark_threshold = dark_threshold / total_pixels * 0.7
+    dark_pixels = sum(np.count_nonzero((view < dark_threshold) & (mask > 0)) for view, mask in zip(views, masks))
+    return dark_circles_result(dark_pixels, total_pixels)
+
+# Detectors that are meaningful for each zone
+ZONE_DETECTORS = {
+    't_zone': {'oiliness': zone_oiliness},
+    'cheeks': {'dryness': zone_dryness, 'redness': zone_redness},
+    'under_eye': {'dark_circles': zone_dark_circles}
+}
+
+def analyze_zones(features):
+    """
+    Run the zone-specific detectors on views of the shared planes
+    Returns: {zone: {detector: result}}
+    """
+    return {
+        zone: {name: detector(features, FACIAL_ZONES[zone]) for name, detector in detectors.items()}
+        for zone, detectors in ZONE_DETECTORS.items()
     }
 
+# Heatmaps are a coarse (rows, columns) grid of local severity over the face crop
+HEATMAP_GRID = (8, 8)
+# Heatmap values (0-100) are quantized to one byte per tile
+HEATMAP_LEVELS = 255
+
+def tile_edges(shape, grid):
+    """Row and column edges of a grid of near-equal tiles"""
+    return (
+        np.linspace(0, shape[0], grid[0] + 1).astype(int),
+        np.linspace(0, shape[1], grid[1] + 1).astype(int)
+    )
+
+def box_sums(integral, rows, cols):
+    """Sums over the tiles between consecutive row and column edges, read off an integral image"""
+    corners = integral[np.ix_(rows, cols)]
+    return corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+
+def tile_counts(shape, grid, skin=None):
+    """Pixels (skin pixels, with a mask) of every tile"""
+    rows, cols = tile_edges(shape, grid)
+    if skin is None:
+        return np.outer(np.diff(rows), np.diff(cols)).astype(float)
+    return box_sums(cv2.integral(skin, sdepth=cv2.CV_64F), rows, cols) / 255
+
+def _per_pixel(sums, counts):
+    # Tiles without skin pixels get 0
+    return np.divide(sums, counts, out=np.zeros(sums.shape), where=counts > 0)
+
+def tile_moments(plane, grid, skin=None):
+    """
+    Pixel count, mean and variance of every tile (over its skin pixels, with a mask),
+    from one integral image pass over the plane
+    Returns: (counts, means, variances) arrays of the grid's shape (with channels for multi-channel planes)
+    """
+    rows, cols = tile_edges(plane.shape, grid)
+    counts = tile_counts(plane.shape, grid, skin)
+    if skin is not None:
+        # Zero the other pixels, so they add nothing to the box sums
+        plane = cv2.bitwise_and(plane, plane, mask=skin)
+    sums, squares = cv2.integral2(plane, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+    if plane.ndim == 3:
+        counts = counts[:, :, None]
+    means = _per_pixel(box_sums(sums, rows, cols), counts)
+    variances = np.maximum(_per_pixel(box_sums(squares, rows, cols), counts) - means ** 2, 0)
+    return counts, means, variances
+
+def tile_fractions(mask, grid, skin=None):
+    """
+    Fraction of nonzero pixels of a 0/1 mask in every tile, relative to the tile's skin pixels with a skin mask
+    Returns: (counts, fractions) arrays of the grid's shape
+    """
+    rows, cols = tile_edges(mask.shape, grid)
+    counts = tile_counts(mask.shape, grid, skin)
+    return counts, _per_pixel(box_sums(cv2.integral(mask, sdepth=cv2.CV_64F), rows, cols), counts)
+
+def severity_grid(result_function, *tile_values):
+    """Apply a detector's result function to every tile; Returns: float array of its severity or score"""
+    def severity(*values):
+        result = result_function(*values)
+        return result.get('severity', result.get('score'))
+    return np.vectorize(severity, otypes=[float])(*tile_values)
+
+def encode_heatmap(values):
+    """
+    Quantize a grid of 0-100 values to one byte per tile
+    Returns: dict with the grid shape and the bytes in base64, row by row
+    """
+    quantized = np.clip(np.rint(values * (HEATMAP_LEVELS / 100)), 0, HEATMAP_LEVELS).astype(np.uint8)
+    return {
+        'shape': list(quantized.shape),
+        'max': 100,
+        'data': base64.b64encode(quantized.tobytes()).decode('ascii')
+    }
+
+def decode_heatmap(heatmap):
+    """Returns: float array of the grid shape with 0-100 values"""
+    quantized = np.frombuffer(base64.b64decode(heatmap['data']), np.uint8).reshape(heatmap['shape'])
+    return quantized * (heatmap['max'] / HEATMAP_LEVELS)
+
+def _heatmap_mask(features):
+    """Zeroed 0/1 mask of the crop's size"""
+    mask = features.buffer('heatmap_mask')
+    if mask is None:
+        return np.zeros(features.image.shape[:2], np.uint8)
+    mask[:] = 0
+    return mask
+
+def acne_heatmap(features, grid):
+    # Fill the contours in the acne size range and measure their area per tile
+    contours, min_area, max_area = acne_spot_contours(features)
+    spots = [contour for contour in contours if len(contour) >= 3 and min_area < cv2.contourArea(contour) < max_area]
+    spot_mask = _heatmap_mask(features)
+    cv2.drawContours(spot_mask, spots, -1, 1, thickness=cv2.FILLED)
+    counts, fractions = tile_fractions(spot_mask, grid, features.skin_mask)
+    return severity_grid(lambda area, pixels: acne_result(0, area, pixels), fractions * counts, np.maximum(counts, 1))
+
+def dark_circles_heatmap(features, grid):
+    # Pixels of the eye region darker than its average lightness, as in detect_dark_circles
+    height = features.image.shape[0]
+    eye_region = features.lab[:height//2, :, 0]
+    eye_skin = features.skin_mask[:height//2] if features.skin_mask is not None else None
+    dark = np.empty(eye_region.shape, bool)
+    count_dark_pixels(eye_region, eye_skin, dark)
+    
+    dark_mask = _heatmap_mask(features)
+    dark_mask[:height//2] = dark
+    counts, fractions = tile_fractions(dark_mask, grid, features.skin_mask)
+    return severity_grid(dark_circles_result, fractions * counts, np.maximum(counts, 1))
+
+def redness_heatmap(features, grid):
+    # The red-hue mask itself is needed per pixel, so this converts to HSV
+    hsv = cv2.cvtColor(features.image, cv2.COLOR_BGR2HSV)
+    red_mask = sum(cv2.inRange(hsv, lower, upper) // 255 for lower, upper in RED_HSV_RANGES)
+    red_mask = cv2.bitwise_and(red_mask, red_mask, mask=features.skin_mask)
+    counts, fractions = tile_fractions(red_mask, grid, features.skin_mask)
+    return severity_grid(redness_result, fractions * counts, np.maximum(counts, 1))
+
+def oiliness_heatmap(features, grid):
+    _, _, variances = tile_moments(features.gray, grid, features.skin_mask)
+    return severity_grid(oiliness_result, features.to_full_resolution('oiliness', variances))
+
+def dryness_heatmap(features, grid):
+    _, _, variances = tile_moments(features.laplacian, grid, features.skin_mask)
+    return severity_grid(dryness_result, features.to_full_resolution('dryness', variances))
+
+def uneven_tone_heatmap(features, grid):
+    _, _, variances = tile_moments(features.lab, grid, features.skin_mask)
+    stds = features.to_full_resolution('uneven_tone', np.sqrt(variances))
+    return severity_grid(uneven_tone_result, stds[:, :, 1], stds[:, :, 2])
+
+def texture_heatmap(features, grid):
+    _, means, _ = tile_moments(features.gradient_magnitude, grid, features.skin_mask)
+    return severity_grid(texture_result, features.to_full_resolution('texture', means))
+
+class SkinDetector:
+    """
+    One analyzer of the registry: the planes it reads, the keys of its result,
+    an optional heatmap of its local severity and its measured wall time.
+    """
+    def __init__(self, name, analyze, inputs, outputs, heatmap=None):
+        self.name = name
+        self._analyze = analyze
+        self.inputs = inputs
+        self.outputs = outputs
+        self.heatmap = heatmap
+        self.calls = 0
+        self.total_ms = 0.0
+        self._lock = threading.Lock()
+    
+    def run(self, features):
+        """
+        Returns: (result dict, elapsed ms)
+        """
+        start = time.perf_counter()
+        result = self._analyze(features)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.calls += 1
+            self.total_ms += elapsed_ms
+        return result, elapsed_ms
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'inputs': list(self.inputs),
+                'outputs': {key: kind.__name__ for key, kind in self.outputs.items()},
+                'calls': self.calls,
+                'average_ms': round(self.total_ms / self.calls, 3) if self.calls else None
+            }
+
+# All analyzers in result order; each declares the shared planes it reads and its output schema
+skin_detectors = {
+    detector.name: detector for detector in [
+        SkinDetector(
+            'acne_spots', detect_acne, ('blurred_gray', 'skin_mask'),
+            {'count': int, 'severity': float, 'level': str}, acne_heatmap
+        ),
+        SkinDetector(
+            'dark_circles', detect_dark_circles, ('lab', 'skin_mask'),
+            {'severity': float, 'level': str}, dark_circles_heatmap
+        ),
+        SkinDetector(
+            'redness', detect_redness, ('color_histogram',),
+            {'severity': float, 'level': str}, redness_heatmap
+        ),
+        SkinDetector(
+            'oiliness', detect_oiliness, ('gray', 'skin_mask'),
+            {'score': float, 'level': str}, oiliness_heatmap
+        ),
+        SkinDetector(
+            'dryness', detect_dryness, ('laplacian', 'skin_mask'),
+            {'score': float, 'level': str}, dryness_heatmap
+        ),
+        SkinDetector(
+            'uneven_tone', detect_uneven_tone, ('color_histogram',),
+            {'score': float, 'level': str}, uneven_tone_heatmap
+        ),
+        SkinDetector(
+            'texture', analyze_texture, ('gradient_magnitude', 'skin_mask'),
+            {'score': float, 'smoothness': str}, texture_heatmap
+        ),
+        SkinDetector(
+            'skin_tone', detect_skin_tone, ('lab', 'skin_mask'),
+            {'category': str, 'ita': float, 'undertone': str, 'lab': list, 'coverage': float}
+        ),
+        SkinDetector(
+            'zones', analyze_zones, ('gray', 'laplacian', 'lab', 'skin_mask'),
+            dict.fromkeys(ZONE_DETECTORS, dict)
+        )
+    ]
+}
+
+def get_skin_detector_stats():
+    """Inputs, output schema and average wall time of every registered detector"""
+    return {name: detector.stats() for name, detector in skin_detectors.items()}
+
 def calculate_skin_health_score(analysis):
     """
     Calculate overall skin health score (0-100)
@@ -203,3 +868,60 @@ def calculate_skin_health_score(analysis):
     
     return max(0, min(100, round(health_score, 2)))
 
+# Metrics read by the scoring and classification rules: (field, detector, result key, default when missing)
+SCORED_METRICS = [
+    ('acne', 'acne_spots', 'severity', 0),
+    ('dark_circles', 'dark_circles', 'severity', 0),
+    ('redness', 'redness', 'severity', 0),
+    ('uneven_tone', 'uneven_tone', 'score', 0),
+    ('oiliness', 'oiliness', 'score', 50),
+    ('dryness', 'dryness', 'score', 50),
+    ('texture', 'texture', 'score', 0)
+]
+# Detectors whose results the scores need; an analysis limited to fewer detectors is partial
+SCORED_DETECTORS = [name for _, name, _, _ in SCORED_METRICS]
+
+def is_complete_analysis(analysis):
+    """Whether an analysis has every metric the health score and skin type read"""
+    return all(name in analysis for name in SCORED_DETECTORS)
+
+# One row per analysis; 'empty' marks analyses without results (no face)
+METRICS_DTYPE = np.dtype([('empty', bool)] + [(field, np.float64) for field, _, _, _ in SCORED_METRICS])
+
+def analysis_metrics(analyses):
+    """
+    Scored metrics of many analysis dicts, with the defaults of the scalar functions
+    Returns: structured array of METRICS_DTYPE, one row per analysis
+    """
+    return np.array([
+        (not analysis,) + tuple(analysis.get(name, {}).get(key, default) for _, name, key, default in SCORED_METRICS)
+        for analysis in analyses
+    ], dtype=METRICS_DTYPE)
+
+def round_like_python(values, decimals):
+    """
+    np.round, except that values within float error of a rounding tie are rounded by
+    Python's round (which rounds the exact decimal value), so every value matches it
+    """
+    rounded = np.round(values, decimals)
+    scaled = values * 10 ** decimals
+    ties = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    rounded[ties] = [round(float(value), decimals) for value in values[ties]]
+    return rounded
+
+def calculate_skin_health_scores(metrics):
+    """
+    calculate_skin_health_score for every row of an analysis_metrics array
+    Returns: float array of scores, equal to the scalar function row by row on stored
+             (JSON) analyses, whose values are Python floats and ints
+    """
+    # Same operations in the same order as the scalar function, so the floats are identical
+    acne_penalty = np.minimum(30, metrics['acne'] * 0.3)
+    dark_circles_penalty = np.minimum(20, metrics['dark_circles'] * 0.2)
+    redness_penalty = np.minimum(15, metrics['redness'] * 0.15)
+    uneven_tone_penalty = np.minimum(15, metrics['uneven_tone'] * 0.15)
+    balance_penalty = np.abs(metrics['oiliness'] - metrics['dryness']) * 0.1
+    
+    health_score = 100 - acne_penalty - dark_circles_penalty - redness_penalty - uneven_tone_penalty - balance_penalty
+    health_score = np.clip(round_like_python(health_score, 2), 0, 100)
+    return np.where(metrics['empty'], 0, health_score)
@@ -1,7 +1,28 @@
+import hashlib
+import io
+import json
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
 import joblib
 import os
+import sqlite3
+import threading
+import time
+import warnings
+from functools import partial
+
+from utils.forest_inference import CompiledForest, compile_forest
+from utils.skin_analysis import analysis_metrics, is_complete_analysis
+
+MODEL_PATH = 'models/skin_classifier.pkl'
+# Seconds between checks of the model file for a new version
+MODEL_CHECK_INTERVAL = 2.0
+# Columns of the model's feature matrix, as named in utils.skin_analysis.analysis_metrics
+MODEL_FEATURES = ('oiliness', 'dryness', 'acne', 'redness')
+# Synthetic samples generated when training without stored reports
+TRAINING_SAMPLES = 1000
+# Cores the forest is trained on (-1: all of them)
+TRAINING_JOBS = -1
 
 def classify_skin_type(analysis):
     """
@@ -78,70 +99,290 @@ def classify_skin_type(analysis):
         # Default to combination for ambiguous cases
         return 'Combination'
 
-def train_skin_classifier():
-    """
-    Train a ML model for skin type classification
-    This is a placeholder - in production, use real labeled data
-    """
-    # Generate synthetic training data (replace with real data)
-    np.random.seed(42)
-    n_samples = 1000
-    
-    # Feature matrix: [oiliness, dryness, acne_severity, redness_severity]
-    X = np.random.rand(n_samples, 4) * 100
-    
-    # Labels based on improved rules
-    y = []
-    for i in range(n_samples):
-        oiliness = X[i, 0]
-        dryness = X[i, 1]
-        acne = X[i, 2]
-        redness = X[i, 3]
-        oil_dry_diff = oiliness - dryness
-        
-        # Sensitive skin
-        if redness > 25 or (redness > 15 and X[i, 0] > 20):  # uneven_tone proxy
-            y.append('Sensitive')
-        # Oily skin
-        elif oiliness > 65 and oil_dry_diff > 30:
-            y.append('Oily')
-        # Dry skin
-        elif dryness > 60 and oil_dry_diff < -25:
-            y.append('Dry')
-        # Normal skin
-        elif (30 <= oiliness <= 55 and 30 <= dryness <= 55 and 
-              abs(oil_dry_diff) <= 15 and acne < 15 and redness < 15):
-            y.append('Normal')
-        # Combination skin
-        else:
-            y.append('Combination')
+def classify_skin_types(metrics):
+    """
+    classify_skin_type for every row of an analysis_metrics array (utils.skin_analysis)
+    Each rule becomes a boolean array and the first matching rule wins, in the scalar function's order
+    Returns: array of skin type labels, equal to the scalar function row by row
+    """
+    oiliness_score = metrics['oiliness']
+    dryness_score = metrics['dryness']
+    acne_severity = metrics['acne']
+    redness_severity = metrics['redness']
+    uneven_tone_score = metrics['uneven_tone']
+    texture_score = metrics['texture']
+    oil_dry_diff = oiliness_score - dryness_score
     
-    # Train model
-    model = RandomForestClassifier(n_estimators=100, random_state=42)
-    model.fit(X, y)
+    sensitive = (redness_severity > 25) | ((redness_severity > 15) & (uneven_tone_score > 20))
+    oily = (oiliness_score > 65) & ((oil_dry_diff > 30) | ((oiliness_score > 70) & (acne_severity > 10)))
+    dry = (dryness_score > 60) & ((oil_dry_diff < -25) | ((dryness_score > 65) & (texture_score > 30)))
+    normal = (
+        (30 <= oiliness_score) & (oiliness_score <= 55) &
+        (30 <= dryness_score) & (dryness_score <= 55) &
+        (np.abs(oil_dry_diff) <= 15) &
+        (acne_severity < 15) &
+        (redness_severity < 15)
+    )
+    mixed = (
+        ((oiliness_score > 45) & (dryness_score > 35)) |
+        ((40 <= oiliness_score) & (oiliness_score <= 65) & (35 <= dryness_score) & (dryness_score <= 60) &
+         (np.abs(oil_dry_diff) < 30))
+    )
+    combination = mixed & (np.abs(oil_dry_diff) < 25) & ((oiliness_score > 50) | (dryness_score > 50))
+    # Fallback on the dominant characteristic
+    balanced_low = (np.abs(oil_dry_diff) <= 20) & (oiliness_score < 50) & (dryness_score < 50)
     
-    # Save model
-    os.makedirs('models', exist_ok=True)
-    joblib.dump(model, 'models/skin_classifier.pkl')
+    return np.select(
+        [metrics['empty'], sensitive, oily, dry, normal, combination, oil_dry_diff > 25, oil_dry_diff < -25, balanced_low],
+        ['Normal', 'Sensitive', 'Oily', 'Dry', 'Normal', 'Combination', 'Oily', 'Dry', 'Normal'],
+        default='Combination'
+    )
+
+def synthetic_training_data(n_samples=TRAINING_SAMPLES, seed=42):
+    """
+    Random model features labelled by simplified rules
+    This is a placeholder - in production, train on real labeled data (report_training_data)
+    Returns: (X, y) with X of shape (n_samples, 4) in MODEL_FEATURES order and y the labels
+    """
+    X = np.random.RandomState(seed).rand(n_samples, 4) * 100
+    oiliness, dryness, acne, redness = X.T
+    oil_dry_diff = oiliness - dryness
     
-    return model
+    # First matching rule wins; oiliness stands in for the uneven tone the model does not see
+    y = np.select(
+        [
+            (redness > 25) | ((redness > 15) & (oiliness > 20)),
+            (oiliness > 65) & (oil_dry_diff > 30),
+            (dryness > 60) & (oil_dry_diff < -25),
+            (30 <= oiliness) & (oiliness <= 55) & (30 <= dryness) & (dryness <= 55) &
+            (np.abs(oil_dry_diff) <= 15) & (acne < 15) & (redness < 15)
+        ],
+        ['Sensitive', 'Oily', 'Dry', 'Normal'],
+        default='Combination'
+    )
+    return X, y
+
+def report_training_data(db_path='skincare.db'):
+    """
+    Model features of the stored reports, labelled with the skin type each report was given
+    Reports without analysis results (no face found) or limited to some detectors are left out,
+    as their missing metrics would be read as defaults
+    Returns: (X, y) with X of shape (reports, 4) in MODEL_FEATURES order and y the labels
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        c = conn.cursor()
+        c.execute('SELECT skin_type, analysis_data FROM reports WHERE skin_type IS NOT NULL AND analysis_data IS NOT NULL')
+        rows = c.fetchall()
+    finally:
+        conn.close()
+    
+    analyses = [json.loads(row[1]) for row in rows]
+    complete = [i for i, analysis in enumerate(analyses) if is_complete_analysis(analysis)]
+    metrics = analysis_metrics([analyses[i] for i in complete])
+    X = np.column_stack([metrics[name] for name in MODEL_FEATURES])
+    y = np.array([rows[i][0] for i in complete], dtype=str)
+    return X, y
+
+def fit_skin_classifier(X, y, n_jobs=TRAINING_JOBS):
+    """
+    Fit the skin type forest, building its trees on n_jobs cores (-1: all of them)
+    Accuracy is the out-of-bag estimate: each sample is predicted by the trees that did not train on it
+    Returns: (model, report dict with samples, classes, jobs, train_time_ms and oob_accuracy)
+    """
+    if len(X) < 2 or len(np.unique(y)) < 2:
+        raise ValueError(f"Need at least 2 samples of 2 skin types to train, got {len(X)} samples")
+    
+    model = RandomForestClassifier(n_estimators=100, random_state=42, oob_score=True, n_jobs=n_jobs)
+    start = time.perf_counter()
+    with warnings.catch_warnings():
+        # Few samples leave some without out-of-bag trees; they are left out of the estimate
+        warnings.simplefilter('ignore', UserWarning)
+        model.fit(X, y)
+    elapsed = time.perf_counter() - start
+    # Prediction only needs the trees, not the worker count of the training machine
+    model.n_jobs = None
+    
+    labels, counts = np.unique(y, return_counts=True)
+    return model, {
+        'samples': len(X),
+        'classes': dict(zip(labels.tolist(), counts.tolist())),
+        'jobs': joblib.effective_n_jobs(n_jobs),
+        'train_time_ms': round(elapsed * 1000, 2),
+        'oob_accuracy': round(float(model.oob_score_), 4)
+    }
+
+def train_skin_classifier(model_path=MODEL_PATH, n_samples=TRAINING_SAMPLES, db_path=None, n_jobs=TRAINING_JOBS):
+    """
+    Train a ML model for skin type classification and save it to model_path
+    Trains on the reports stored in db_path when given, otherwise on n_samples synthetic samples
+    Returns: (model, training report dict, see fit_skin_classifier, with the data source)
+    """
+    if db_path:
+        X, y = report_training_data(db_path)
+    else:
+        X, y = synthetic_training_data(n_samples)
+    
+    model, report = fit_skin_classifier(X, y, n_jobs)
+    report['source'] = db_path or 'synthetic'
+    save_skin_classifier(model, model_path)
+    
+    return model, report
+
+def save_skin_classifier(model, model_path=MODEL_PATH):
+    """Write the model to a temporary file and move it into place, so readers never see a partial file"""
+    os.makedirs(os.path.dirname(model_path) or '.', exist_ok=True)
+    temporary_path = f"{model_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    joblib.dump(model, temporary_path)
+    os.replace(temporary_path, model_path)
 
 def load_skin_classifier():
     """Load trained skin classifier model"""
-    model_path = 'models/skin_classifier.pkl'
+    model_path = MODEL_PATH
     
     if os.path.exists(model_path):
         return joblib.load(model_path)
     else:
         # Train and save if not exists
-        return train_skin_classifier()
+        return train_skin_classifier()[0]
+
+class ModelRegistry:
+    """
+    Process-wide holder of the trained skin classifier.
+    The model file is loaded once, random forests compiled to flat node arrays, and versioned
+    by its mtime, size and inode; a new version is loaded in the background and swapped in
+    when ready. A missing model is trained in the background. Until a model is available,
+    get() returns None and callers fall back to the rules, so no request ever waits for
+    loading or training.
+    """
+    def __init__(self, model_path=MODEL_PATH, trainer=train_skin_classifier, check_interval=MODEL_CHECK_INTERVAL):
+        self.model_path = model_path
+        self.trainer = trainer
+        self.check_interval = check_interval
+        self._model = None
+        self._version = None
+        self._sha256 = None
+        self._pending_version = None
+        self._worker = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.load_time = 0.0
+        self.trainings = 0
+        self.errors = 0
+        self.last_error = None
+    
+    def _file_version(self):
+        try:
+            stat = os.stat(self.model_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    
+    def _load(self, version):
+        start = time.perf_counter()
+        with open(self.model_path, 'rb') as f:
+            data = f.read()
+        model = joblib.load(io.BytesIO(data))
+        if isinstance(model, RandomForestClassifier):
+            # Requests only need predictions, served from the flattened trees
+            model = compile_forest(model)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._model = model
+            self._version = version
+            self._sha256 = hashlib.sha256(data).hexdigest()
+            self.loads += 1
+            self.load_time += elapsed
+    
+    def _train(self):
+        self.trainer(self.model_path)
+        with self._lock:
+            self.trainings += 1
+        version = self._file_version()
+        if version is not None:
+            self._load(version)
+    
+    def _run(self, task):
+        try:
+            task()
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+                self.last_error = str(e)
+        finally:
+            with self._lock:
+                self._worker = None
+    
+    def _start(self, task, version=None):
+        """Run a load or training in the background unless one is already running (lock held)"""
+        if self._worker is not None:
+            return
+        self._pending_version = version
+        self._worker = threading.Thread(target=self._run, args=(task,), daemon=True)
+        self._worker.start()
+    
+    def get(self):
+        """
+        The current model, checking at most every check_interval seconds for a new file version
+        Returns: the model, or None while none is available yet
+        """
+        now = time.monotonic()
+        if now < self._next_check:
+            return self._model
+        
+        version = self._file_version()
+        with self._lock:
+            self._next_check = now + self.check_interval
+            if version is None:
+                if self._model is None and not self.trainings and not self.errors:
+                    self._start(self._train)
+            elif version != self._version and version != self._pending_version:
+                # A version that failed to load is not retried until the file changes again
+                self._start(partial(self._load, version), version)
+            return self._model
+    
+    def warm_up(self):
+        """Load (or train) the model in the calling thread, e.g. at startup"""
+        version = self._file_version()
+        if version is None:
+            self._train()
+        elif version != self._version:
+            self._load(version)
+    
+    def wait(self, timeout=None):
+        """Wait for a background load or training to finish"""
+        worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': self._model is not None,
+                'compiled': isinstance(self._model, CompiledForest),
+                'sha256': self._sha256,
+                'modified_at': self._version[0] / 1e9 if self._version else None,
+                'loads': self.loads,
+                'load_time_ms': round(self.load_time * 1000, 3),
+                'trainings': self.trainings,
+                'updating': self._worker is not None,
+                'errors': self.errors,
+                'last_error': self.last_error
+            }
+
+# Shared by every request handled by this process
+skin_model_registry = ModelRegistry()
 
 def classify_with_model(analysis):
     """
     Classify skin type using trained ML model
     """
     try:
-        model = load_skin_classifier()
+        # Loading and training happen in the background; until then the rules answer
+        model = skin_model_registry.get()
+        if model is None:
+            return classify_skin_type(analysis)
         
         # Extract features (model uses 4 features: oiliness, dryness, acne, redness)
         features = np.array([[
@@ -0,0 +1,200 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+import cv2
+import numpy as np
+
+from utils.image_ingest import analysis_scale
+from utils.skin_analysis import SkinFeatures, analyze_features
+
+# Face crops of a session are split into this many (rows, columns) tiles
+STREAM_TILE_GRID = (4, 4)
+# Mean absolute gray difference (0-255) from the last analyzed content above which a tile is recomputed
+STREAM_CHANGE_THRESHOLD = 4.0
+# Number of recent frames the stabilized result is the median of
+STREAM_WINDOW = 7
+# Sessions idle for longer than this are dropped
+STREAM_SESSION_TTL = 600
+# Every session keeps full-crop planes (about 13 MB at a 1024 px crop), so their number is
+# bounded per user and overall; a new session evicts the least recently used one
+STREAM_MAX_SESSIONS = 32
+STREAM_MAX_SESSIONS_PER_USER = 2
+
+# Planes kept per session and updated tile by tile. A tile is recomputed with this
+# margin around it (the 5x5 blur needs 2 pixels), so the kept planes are exactly
+# the planes of the full crop.
+STREAM_PLANES = ('blurred_gray', 'lab', 'laplacian', 'gradient_magnitude')
+STREAM_TILE_MARGIN = 2
+
+def _value(result):
+    return result.get('severity', result.get('score', result.get('ita')))
+
+def _median_result(results):
+    """The result whose value is the median of the window, so value and level stay consistent"""
+    ordered = sorted(results, key=_value)
+    return ordered[(len(ordered) - 1) // 2]
+
+def stabilize(history):
+    """
+    Per-metric windowed median over the analyses of consecutive frames
+    Returns: analysis dict in the same format as analyze_skin
+    """
+    latest = history[-1]
+    stable = {
+        name: _median_result([analysis[name] for analysis in history])
+        for name in latest if name != 'zones'
+    }
+    if 'zones' in latest:
+        stable['zones'] = {
+            zone: {
+                name: _median_result([analysis['zones'][zone][name] for analysis in history])
+                for name in detectors
+            }
+            for zone, detectors in latest['zones'].items()
+        }
+    return stable
+
+class StreamingAnalysis:
+    """
+    Analysis of consecutive webcam frames of one session. Derived planes are kept
+    between frames and only the tiles whose content changed are recomputed; the
+    reported result is a windowed median over the recent frames.
+    """
+    def __init__(self, window=STREAM_WINDOW, grid=STREAM_TILE_GRID, change_threshold=STREAM_CHANGE_THRESHOLD, owner=None):
+        self.owner = owner
+        self.grid = grid
+        self.change_threshold = change_threshold
+        self.history = deque(maxlen=window)
+        self.frame_shape = None
+        self.image_info = None
+        self.upload = None
+        self.frames = 0
+        self.recomputed_tiles = 0
+        self.last_used = time.time()
+        self._planes = {}
+        self._reference_gray = None
+        self._tiles = []
+        self._lock = threading.Lock()
+    
+    def _start(self, face_image):
+        height, width = face_image.shape[:2]
+        self.frame_shape = (height, width)
+        rows = np.linspace(0, height, self.grid[0] + 1).astype(int)
+        cols = np.linspace(0, width, self.grid[1] + 1).astype(int)
+        self._tiles = [
+            (rows[i], rows[i + 1], cols[j], cols[j + 1])
+            for i in range(self.grid[0]) for j in range(self.grid[1])
+        ]
+    
+    def _changed_tiles(self, gray):
+        if self._reference_gray is None:
+            return list(self._tiles)
+        diff = cv2.absdiff(gray, self._reference_gray)
+        return [
+            (y0, y1, x0, x1) for y0, y1, x0, x1 in self._tiles
+            if cv2.mean(diff[y0:y1, x0:x1])[0] > self.change_threshold
+        ]
+    
+    def _recompute_tile(self, face_image, gray, tile):
+        y0, y1, x0, x1 = tile
+        height, width = self.frame_shape
+        ey0, ey1 = max(0, y0 - STREAM_TILE_MARGIN), min(height, y1 + STREAM_TILE_MARGIN)
+        ex0, ex1 = max(0, x0 - STREAM_TILE_MARGIN), min(width, x1 + STREAM_TILE_MARGIN)
+        region = SkinFeatures(face_image[ey0:ey1, ex0:ex1], planes={'gray': gray[ey0:ey1, ex0:ex1]})
+        
+        inner = (slice(y0 - ey0, y1 - ey0), slice(x0 - ex0, x1 - ex0))
+        for name in STREAM_PLANES:
+            self._planes[name][y0:y1, x0:x1] = region.plane(name)[inner]
+        self._reference_gray[y0:y1, x0:x1] = gray[y0:y1, x0:x1]
+    
+    def add_frame(self, face_image, image_info=None, upload=None):
+        """
+        Analyze the next face crop of the session
+        image_info and upload of the latest frame are kept for the final report
+        Returns: stabilized analysis dict over the recent frames
+        """
+        with self._lock:
+            self.last_used = time.time()
+            # Thresholds refer to the original photo, like the results of single uploads
+            scale = analysis_scale(image_info) if image_info is not None else 1.0
+            if self.frame_shape is None:
+                self._start(face_image)
+            elif face_image.shape[:2] != self.frame_shape:
+                # Keep one geometry per session so tiles line up between frames
+                height, width = self.frame_shape
+                scale *= height / face_image.shape[0]
+                face_image = cv2.resize(face_image, (width, height), interpolation=cv2.INTER_AREA)
+            
+            gray = cv2.cvtColor(face_image, cv2.COLOR_BGR2GRAY)
+            changed = self._changed_tiles(gray)
+            if len(changed) == len(self._tiles):
+                # Everything changed (or first frame): compute the planes for the whole crop
+                features = SkinFeatures(face_image, planes={'gray': gray})
+                self._planes = {name: features.plane(name).copy() for name in STREAM_PLANES}
+                self._reference_gray = gray.copy()
+            else:
+                for tile in changed:
+                    self._recompute_tile(face_image, gray, tile)
+            
+            features = SkinFeatures(face_image, scale, planes=dict(self._planes, gray=gray))
+            self.history.append(analyze_features(features))
+            self.frames += 1
+            self.recomputed_tiles += len(changed)
+            if image_info is not None:
+                self.image_info = image_info
+            if upload is not None:
+                self.upload = upload
+            
+            return stabilize(self.history)
+    
+    def result(self):
+        with self._lock:
+            return stabilize(self.history) if self.history else {}
+    
+    def stats(self):
+        total_tiles = self.frames * len(self._tiles)
+        return {
+            'frames': self.frames,
+            'recomputed_tiles': self.recomputed_tiles,
+            'recomputed_fraction': round(self.recomputed_tiles / total_tiles, 4) if total_tiles else 0
+        }
+
+# Session-scoped streaming analyses (in-memory, like the face trackers), least recently used first
+stream_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+def get_stream_session(session_key, owner=None):
+    """
+    Get or create the streaming analysis for one capture session
+    A new session evicts the least recently used session of the same owner beyond
+    STREAM_MAX_SESSIONS_PER_USER, and the least recently used overall beyond STREAM_MAX_SESSIONS
+    """
+    now = time.time()
+    with _sessions_lock:
+        # Drop sessions that were never finished
+        for key in [key for key, stream in stream_sessions.items() if now - stream.last_used > STREAM_SESSION_TTL]:
+            del stream_sessions[key]
+        
+        stream = stream_sessions.get(session_key)
+        if stream is not None:
+            stream_sessions.move_to_end(session_key)
+            return stream
+        
+        if owner is not None:
+            owned = [key for key, stream in stream_sessions.items() if stream.owner == owner]
+            for key in owned[:max(0, len(owned) - STREAM_MAX_SESSIONS_PER_USER + 1)]:
+                del stream_sessions[key]
+        while len(stream_sessions) >= STREAM_MAX_SESSIONS:
+            stream_sessions.popitem(last=False)
+        
+        stream = stream_sessions[session_key] = StreamingAnalysis(owner=owner)
+        return stream
+
+def end_stream_session(session_key):
+    """
+    Finish a capture session
+    Returns: its StreamingAnalysis, or None if there was none
+    """
+    with _sessions_lock:
+        return stream_sessions.pop(session_key, None)